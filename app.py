@@ -1,15 +1,36 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, send_file
-import sqlite3, pandas as pd, unicodedata, datetime, json, os, secrets
-from io import BytesIO
+from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, send_file, g, has_app_context, Response, session, make_response
+import sqlite3, unicodedata, datetime, json, os, sys, secrets, threading, queue, time, csv, io, tempfile, atexit, collections, hashlib, gzip, codecs, zipfile, zlib
 
 # Auth
 from flask_login import LoginManager, UserMixin, login_user, login_required, logout_user, current_user
 from werkzeug.security import generate_password_hash, check_password_hash
 from functools import wraps
+import click
+
+import dashboard_stats, profiling, stage_history
 
 app = Flask(__name__)
 app.secret_key = "dev"
-DB_FILE = "crm_v4.db"
+DB_FILE = os.environ.get("CRM_DB", "crm_v4.db")
+DB_POOL_SIZE = int(os.environ.get("CRM_DB_POOL_SIZE", "8"))
+DB_POOL_TIMEOUT = 30.0
+DB_PRAGMAS = [
+    ("journal_mode", "WAL"),        # leitores não bloqueiam no writer (drag do board)
+    ("synchronous", "NORMAL"),
+    ("mmap_size", 256 * 1024 * 1024),
+    ("cache_size", -32000),         # ~32 MB por conexão
+    ("busy_timeout", 5000),
+    ("foreign_keys", "ON"),
+]
+
+# Profiling opt-in: latência por rota, SQL por request, Server-Timing (ver /metrics)
+PROFILE = os.environ.get("CRM_PROFILE", "0") == "1"
+profiler = profiling.Profiler()
+if PROFILE:
+    profiler.init_app(app)
+
+# KPIs dos dashboards: cache curto, invalidado pelas rotas que escrevem
+dashboard_cache = dashboard_stats.StatsCache(ttl=float(os.environ.get("CRM_DASHBOARD_TTL", "5")))
 
 # ================= Defaults & Settings =================
 DEFAULT_SETTINGS = {
@@ -18,7 +39,8 @@ DEFAULT_SETTINGS = {
         "Contato Inicial","Fazer FUP","Marcar Reunião","Reunião Marcada",
         "Acompanhar","Projeto Ganho","Projeto Perdido","Potencial Futuro"
     ],
-    "inactive_stages": ["Projeto Perdido","Potencial Futuro"]
+    "inactive_stages": ["Projeto Perdido","Potencial Futuro"],
+    "activity_retention_days": 365
 }
 OPP_STAGES = [
   "Qualificação","Descoberta","Proposta","Negociação","Fechado - Ganho","Fechado - Perdido"
@@ -33,69 +55,540 @@ OPP_PLAYBOOKS = {
 }
 
 # ============== DB helpers ==============
-def get_db():
-    conn = sqlite3.connect(DB_FILE)
+def _connect():
+    factory = profiling.TracedConnection if PROFILE else sqlite3.Connection
+    conn = sqlite3.connect(DB_FILE, check_same_thread=False, factory=factory)
     conn.row_factory = sqlite3.Row
+    for name, value in DB_PRAGMAS:
+        conn.execute(f"PRAGMA {name}={value}")
     return conn
 
-def load_settings(conn):
-    conn.execute("CREATE TABLE IF NOT EXISTS settings (id INTEGER PRIMARY KEY CHECK (id=1), json TEXT)")
-    row = conn.execute("SELECT json FROM settings WHERE id=1").fetchone()
-    cfg = DEFAULT_SETTINGS.copy()
-    if row and row["json"]:
+class ConnectionPool:
+    """Conexões SQLite reaproveitadas entre requests (no máximo `size` em uso)."""
+    def __init__(self, size=DB_POOL_SIZE, timeout=DB_POOL_TIMEOUT):
+        self.size = size
+        self.timeout = timeout
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+        self._lock = threading.Lock()
+        self.stats = {"acquired": 0, "hits": 0, "opened": 0, "waits": 0, "wait_ms": 0.0, "timeouts": 0}
+
+    def _bump(self, key, n=1):
+        with self._lock:
+            self.stats[key] += n
+
+    def acquire(self):
+        if not self._slots.acquire(blocking=False):
+            self._bump("waits")
+            t0 = time.perf_counter()
+            ok = self._slots.acquire(timeout=self.timeout)
+            self._bump("wait_ms", (time.perf_counter() - t0) * 1000)
+            if not ok:
+                self._bump("timeouts")
+                raise sqlite3.OperationalError("pool de conexões esgotado")
+        try:
+            conn = self._idle.get_nowait()
+            self._bump("hits")
+        except queue.Empty:
+            try:
+                conn = _connect()
+            except Exception:
+                self._slots.release()
+                raise
+            self._bump("opened")
+        self._bump("acquired")
+        return conn
+
+    def release(self, conn):
         try:
-            cfg.update(json.loads(row["json"]) or {})
-        except Exception:
-            pass
-    return cfg
+            if conn.in_transaction:
+                conn.rollback()
+            self._idle.put(conn)
+        except sqlite3.Error:
+            conn.close()
+        finally:
+            self._slots.release()
+
+    def snapshot(self):
+        with self._lock:
+            st = dict(self.stats)
+        st["size"] = self.size
+        st["idle"] = self._idle.qsize()
+        st["hit_rate"] = round(st["hits"] / st["acquired"], 3) if st["acquired"] else 0.0
+        st["wait_ms"] = round(st["wait_ms"], 2)
+        return st
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool()
+    return _pool
+
+def get_db():
+    """Conexão do request atual (uma só por request, devolvida ao pool no teardown).
+    Fora de um app context devolve uma conexão avulsa, que o chamador fecha."""
+    if not has_app_context():
+        return _connect()
+    if "db" not in g:
+        g.db = get_pool().acquire()
+    return g.db
+
+@app.teardown_appcontext
+def release_db(exc):
+    conn = g.pop("db", None)
+    if conn is not None:
+        get_pool().release(conn)
+
+# Config parseada em memória, chaveada por settings.rev. Outros workers que
+# gravarem settings são percebidos em até SETTINGS_CHECK_SECONDS.
+SETTINGS_CHECK_SECONDS = float(os.environ.get("CRM_SETTINGS_CHECK_SECONDS", "2"))
+_settings_cache = {"rev": None, "cfg": None, "checked": 0.0}
+_settings_lock = threading.Lock()
+
+def settings_revision(conn):
+    row = conn.execute("SELECT rev FROM settings WHERE id=1").fetchone()
+    return row["rev"] if row else 0
+
+def load_settings(conn):
+    with _settings_lock:
+        now = time.monotonic()
+        cache = _settings_cache
+        if cache["cfg"] is None or now - cache["checked"] >= SETTINGS_CHECK_SECONDS:
+            row = conn.execute("SELECT json, rev FROM settings WHERE id=1").fetchone()
+            rev = row["rev"] if row else 0
+            if cache["cfg"] is None or rev != cache["rev"]:
+                cfg = DEFAULT_SETTINGS.copy()
+                if row and row["json"]:
+                    try:
+                        cfg.update(json.loads(row["json"]) or {})
+                    except Exception:
+                        pass
+                cache["cfg"], cache["rev"] = cfg, rev
+            cache["checked"] = now
+        return cache["cfg"].copy()
+
+def invalidate_settings_cache():
+    with _settings_lock:
+        _settings_cache.update(rev=None, cfg=None, checked=0.0)
 
 def save_settings(conn, cfg):
     js = json.dumps(cfg, ensure_ascii=False)
     with conn:
-        conn.execute("INSERT INTO settings (id,json) VALUES (1, ?) ON CONFLICT(id) DO UPDATE SET json=excluded.json", (js,))
+        conn.execute("""INSERT INTO settings (id,json,rev) VALUES (1, ?, 1)
+                        ON CONFLICT(id) DO UPDATE SET json=excluded.json, rev=settings.rev+1""", (js,))
+    invalidate_settings_cache()
 
-def rebuild_company_status_view(conn, cfg):
-    inactive = cfg["inactive_stages"]
-    conn.executescript("DROP VIEW IF EXISTS company_status_view;")
-    placeholders = ",".join("'" + s.replace("'", "''") + "'" for s in inactive)
-    sql = f"""
-    CREATE VIEW company_status_view AS
-    SELECT
-      c.id,
-      c.name,
-      c.reg_status_base,
-      CASE
-        WHEN EXISTS (
-          SELECT 1 FROM contacts ct WHERE ct.company_id=c.id AND ct.contact_stage NOT IN ({placeholders})
-        ) THEN 'Ativo'
-        WHEN EXISTS (
-          SELECT 1 FROM contacts ct WHERE ct.company_id=c.id
-        ) THEN 'Inativo'
-        ELSE NULL
-      END AS reg_status_effective
-    FROM companies c;
-    """
-    conn.executescript(sql)
+def _sql_list(values):
+    return ",".join("'" + str(v).replace("'", "''") + "'" for v in values) or "''"
 
-def ensure_activity_log(conn):
-    conn.execute("""CREATE TABLE IF NOT EXISTS activity_log (
+def rebuild_company_status(conn, cfg):
+    """Recalcula company_status em lote e recria os triggers que o mantêm.
+    Os estágios inativos ficam embutidos nos triggers, então precisa rodar
+    sempre que cfg["inactive_stages"] mudar."""
+    inactive = _sql_list(cfg["inactive_stages"])
+    is_active = lambda ref: f"COALESCE({ref}.contact_stage NOT IN ({inactive}), 0)"
+    bump = lambda ref, sign: f"""UPDATE company_status
+          SET active_contacts = active_contacts {sign} {is_active(ref)},
+              inactive_contacts = inactive_contacts {sign} (1 - {is_active(ref)})
+          WHERE company_id = {ref}.company_id;"""
+    conn.executescript(f"""
+    BEGIN;
+    DROP TRIGGER IF EXISTS trg_company_status_co_ins;
+    DROP TRIGGER IF EXISTS trg_company_status_co_del;
+    DROP TRIGGER IF EXISTS trg_company_status_ct_ins;
+    DROP TRIGGER IF EXISTS trg_company_status_ct_del;
+    DROP TRIGGER IF EXISTS trg_company_status_ct_upd;
+    DROP TRIGGER IF EXISTS trg_company_status_totals_ins;
+    DROP TRIGGER IF EXISTS trg_company_status_totals_del;
+    DROP TRIGGER IF EXISTS trg_company_status_totals_upd;
+
+    DELETE FROM company_status;
+    INSERT INTO company_status (company_id, active_contacts, inactive_contacts)
+      SELECT co.id,
+             COALESCE(SUM({is_active("ct")}), 0),
+             COALESCE(SUM(ct.id IS NOT NULL AND NOT {is_active("ct")}), 0)
+      FROM companies co LEFT JOIN contacts ct ON ct.company_id = co.id
+      GROUP BY co.id;
+    DELETE FROM company_status_totals;
+    INSERT INTO company_status_totals (status, n)
+      SELECT reg_status_effective, COUNT(*) FROM company_status
+      WHERE reg_status_effective IS NOT NULL GROUP BY reg_status_effective;
+
+    CREATE TRIGGER trg_company_status_co_ins AFTER INSERT ON companies BEGIN
+      INSERT OR IGNORE INTO company_status (company_id) VALUES (NEW.id);
+    END;
+    CREATE TRIGGER trg_company_status_co_del AFTER DELETE ON companies BEGIN
+      DELETE FROM company_status WHERE company_id = OLD.id;
+    END;
+    CREATE TRIGGER trg_company_status_ct_ins AFTER INSERT ON contacts BEGIN
+      INSERT OR IGNORE INTO company_status (company_id) VALUES (NEW.company_id);
+      {bump("NEW", "+")}
+    END;
+    CREATE TRIGGER trg_company_status_ct_del AFTER DELETE ON contacts BEGIN
+      {bump("OLD", "-")}
+    END;
+    CREATE TRIGGER trg_company_status_ct_upd AFTER UPDATE OF contact_stage, company_id ON contacts BEGIN
+      {bump("OLD", "-")}
+      INSERT OR IGNORE INTO company_status (company_id) VALUES (NEW.company_id);
+      {bump("NEW", "+")}
+    END;
+
+    CREATE TRIGGER trg_company_status_totals_ins AFTER INSERT ON company_status
+    WHEN NEW.reg_status_effective IS NOT NULL BEGIN
+      INSERT INTO company_status_totals (status, n) VALUES (NEW.reg_status_effective, 1)
+        ON CONFLICT(status) DO UPDATE SET n = n + 1;
+    END;
+    CREATE TRIGGER trg_company_status_totals_del AFTER DELETE ON company_status
+    WHEN OLD.reg_status_effective IS NOT NULL BEGIN
+      UPDATE company_status_totals SET n = n - 1 WHERE status = OLD.reg_status_effective;
+    END;
+    CREATE TRIGGER trg_company_status_totals_upd AFTER UPDATE ON company_status
+    WHEN OLD.reg_status_effective IS NOT NEW.reg_status_effective BEGIN
+      UPDATE company_status_totals SET n = n - 1 WHERE status = OLD.reg_status_effective;
+      INSERT INTO company_status_totals (status, n)
+        SELECT NEW.reg_status_effective, 1 WHERE NEW.reg_status_effective IS NOT NULL
+        ON CONFLICT(status) DO UPDATE SET n = n + 1;
+    END;
+    COMMIT;
+    """)
+
+# 'YYYY-MM-DD[ hh:mm]' ou 'DD/MM/YYYY' -> 'YYYY-MM-DD'; vazio/inválido -> NULL
+TASK_DATE_SQL = """CASE WHEN {d} GLOB '[0-3][0-9]/[01][0-9]/[0-9][0-9][0-9][0-9]*'
+    THEN date(substr({d},7,4) || '-' || substr({d},4,2) || '-' || substr({d},1,2))
+    ELSE date(NULLIF(TRIM({d}),'')) END"""
+# texto que não vira data (ex.: 'amanhã') vai para due_date_raw em vez de sumir;
+# due_date vazio/NULL mantém o raw que já existia
+TASK_DATE_RAW_SQL = """CASE WHEN ({p}) IS NOT NULL THEN NULL
+    WHEN TRIM(IFNULL({d},'')) <> '' THEN {d} ELSE {raw} END"""
+TASK_NEEDS_NORM = "{r}.due_date IS NOT date({r}.due_date) OR {r}.done IS NULL OR {r}.done NOT IN (0,1)"
+
+def _task_date_set(r, raw):
+    d = f"{r}due_date"
+    parsed = TASK_DATE_SQL.format(d=d)
+    return (f"due_date_raw = {TASK_DATE_RAW_SQL.format(p=parsed, d=d, raw=raw)}, "
+            f"due_date = {parsed}, done = (IFNULL({r}done,0) <> 0)")
+
+def normalize_task_dates(conn):
+    """Deixa tasks.due_date em ISO (ou NULL) e done em 0/1, para que as consultas
+    do dashboard comparem a coluna crua e usem idx_tasks_open_due. Triggers
+    mantêm o formato em qualquer escrita posterior; o texto original que não
+    é data fica em due_date_raw."""
+    if "due_date_raw" not in [r["name"] for r in conn.execute("PRAGMA table_info(tasks)")]:
+        conn.execute("ALTER TABLE tasks ADD COLUMN due_date_raw TEXT")
+    with conn:
+        conn.execute(f"""UPDATE tasks SET {_task_date_set("", "due_date_raw")}
+                         WHERE {TASK_NEEDS_NORM.format(r="tasks")}""")
+    fix = f"""UPDATE tasks SET {_task_date_set("NEW.", "NEW.due_date_raw")} WHERE id = NEW.id;"""
+    conn.executescript(f"""
+    DROP TRIGGER IF EXISTS trg_tasks_norm_ins;
+    DROP TRIGGER IF EXISTS trg_tasks_norm_upd;
+    CREATE TRIGGER trg_tasks_norm_ins AFTER INSERT ON tasks
+    WHEN {TASK_NEEDS_NORM.format(r="NEW")} BEGIN
+      {fix}
+    END;
+    CREATE TRIGGER trg_tasks_norm_upd AFTER UPDATE OF due_date, done ON tasks
+    WHEN {TASK_NEEDS_NORM.format(r="NEW")} BEGIN
+      {fix}
+    END;
+    """)
+
+REVISION_TABLES = ["companies", "contacts", "tasks", "opportunities", "settings"]
+
+def ensure_revision_triggers(conn, tables):
+    """Contador em data_revisions por tabela, incrementado por triggers em qualquer
+    escrita; caches de resultados e ETags usam o valor como chave e changed_at
+    (epoch em segundos) como Last-Modified. Recria os triggers (idempotente)."""
+    conn.execute("CREATE TABLE IF NOT EXISTS data_revisions (name TEXT PRIMARY KEY, rev INTEGER NOT NULL DEFAULT 0) WITHOUT ROWID")
+    if "changed_at" not in [r["name"] for r in conn.execute("PRAGMA table_info(data_revisions)")]:
+        conn.execute("ALTER TABLE data_revisions ADD COLUMN changed_at INTEGER")
+    for t in tables:
+        conn.execute("INSERT OR IGNORE INTO data_revisions (name, rev, changed_at) VALUES (?, 0, CAST(strftime('%s','now') AS INTEGER))", (t,))
+        for op in ("INSERT", "UPDATE", "DELETE"):
+            conn.execute(f"DROP TRIGGER IF EXISTS trg_rev_{t}_{op.lower()}")
+            conn.execute(f"""CREATE TRIGGER trg_rev_{t}_{op.lower()} AFTER {op} ON {t} BEGIN
+                               UPDATE data_revisions SET rev = rev + 1, changed_at = CAST(strftime('%s','now') AS INTEGER)
+                               WHERE name = '{t}';
+                             END""")
+    conn.commit()
+
+def data_revision(conn, name):
+    row = conn.execute("SELECT rev FROM data_revisions WHERE name=?", (name,)).fetchone()
+    return row["rev"] if row else 0
+
+def data_revisions(conn, names):
+    """{nome: rev} e o maior changed_at (epoch) das tabelas pedidas, numa consulta."""
+    rows = conn.execute(f"SELECT name, rev, changed_at FROM data_revisions WHERE name IN ({','.join('?' * len(names))})",
+                        names).fetchall()
+    return {r["name"]: r["rev"] for r in rows}, max((r["changed_at"] or 0 for r in rows), default=0)
+
+def ensure_board_events(conn):
+    """Feed de mudanças de contatos para o board ao vivo, gravado por triggers
+    (qualquer caminho de escrita, em qualquer worker). AUTOINCREMENT para o id
+    nunca voltar depois da poda: ele é o Last-Event-ID do SSE. A poda também é
+    trigger (a cada BOARD_EVENTS_PRUNE_EVERY eventos), então roda mesmo sem
+    nenhum cliente SSE com o relay ligado."""
+    conn.executescript(f"""
+    CREATE TABLE IF NOT EXISTS board_events (
+      id INTEGER PRIMARY KEY AUTOINCREMENT,
+      contact_id INTEGER NOT NULL,
+      from_stage TEXT,
+      to_stage TEXT,
+      ts TEXT DEFAULT CURRENT_TIMESTAMP
+    );
+    DROP TRIGGER IF EXISTS trg_board_events_ins;
+    DROP TRIGGER IF EXISTS trg_board_events_upd;
+    DROP TRIGGER IF EXISTS trg_board_events_del;
+    DROP TRIGGER IF EXISTS trg_board_events_prune;
+    CREATE TRIGGER trg_board_events_prune AFTER INSERT ON board_events
+    WHEN NEW.id % {BOARD_EVENTS_PRUNE_EVERY} = 0 BEGIN
+      DELETE FROM board_events WHERE id <= NEW.id - {BOARD_EVENTS_KEEP};
+    END;
+    CREATE TRIGGER trg_board_events_ins AFTER INSERT ON contacts BEGIN
+      INSERT INTO board_events (contact_id, from_stage, to_stage) VALUES (NEW.id, NULL, NEW.contact_stage);
+    END;
+    CREATE TRIGGER trg_board_events_upd AFTER UPDATE OF contact_stage, name, company_id ON contacts
+    WHEN OLD.contact_stage IS NOT NEW.contact_stage OR OLD.name IS NOT NEW.name OR OLD.company_id IS NOT NEW.company_id BEGIN
+      INSERT INTO board_events (contact_id, from_stage, to_stage) VALUES (NEW.id, OLD.contact_stage, NEW.contact_stage);
+    END;
+    CREATE TRIGGER trg_board_events_del AFTER DELETE ON contacts BEGIN
+      INSERT INTO board_events (contact_id, from_stage, to_stage) VALUES (OLD.id, OLD.contact_stage, NULL);
+    END;
+    """)
+    conn.commit()
+
+def ensure_stage_history(conn):
+    """contact_stage_history (trigger na mesma transação da mudança) + agregados
+    diários. Base sem histórico é preenchida uma vez: movimentos do activity_log
+    (o de origem é o destino anterior) e uma entrada por contato em created_at:
+    no estágio atual, se nunca mudou; senão no estágio padrão de criação
+    ('Contato Inicial', o log não guarda o de origem), para o primeiro arraste
+    contar como saída dele e não como contato novo."""
+    conn.executescript("""
+    CREATE TABLE IF NOT EXISTS contact_stage_history (
+      id INTEGER PRIMARY KEY,
+      contact_id INTEGER NOT NULL,
+      from_stage TEXT,
+      to_stage TEXT,
+      ts TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP
+    );
+    CREATE INDEX IF NOT EXISTS idx_stage_history_contact ON contact_stage_history(contact_id, id);
+    CREATE INDEX IF NOT EXISTS idx_stage_history_ts ON contact_stage_history(ts);
+    CREATE TABLE IF NOT EXISTS stage_daily (
+      day TEXT NOT NULL,
+      stage TEXT NOT NULL,
+      entered INTEGER NOT NULL DEFAULT 0,
+      exited INTEGER NOT NULL DEFAULT 0,
+      dwell_seconds REAL NOT NULL DEFAULT 0,
+      dwell_n INTEGER NOT NULL DEFAULT 0,
+      PRIMARY KEY (day, stage)
+    ) WITHOUT ROWID;
+    CREATE TABLE IF NOT EXISTS stage_transition_daily (
+      day TEXT NOT NULL,
+      from_stage TEXT NOT NULL,
+      to_stage TEXT NOT NULL,
+      n INTEGER NOT NULL DEFAULT 0,
+      PRIMARY KEY (day, from_stage, to_stage)
+    ) WITHOUT ROWID;
+    CREATE TABLE IF NOT EXISTS stage_rollup_state (name TEXT PRIMARY KEY, last_id INTEGER NOT NULL) WITHOUT ROWID;
+    DROP TRIGGER IF EXISTS trg_stage_history_ins;
+    DROP TRIGGER IF EXISTS trg_stage_history_upd;
+    CREATE TRIGGER trg_stage_history_ins AFTER INSERT ON contacts BEGIN
+      INSERT INTO contact_stage_history (contact_id, from_stage, to_stage) VALUES (NEW.id, NULL, NEW.contact_stage);
+    END;
+    CREATE TRIGGER trg_stage_history_upd AFTER UPDATE OF contact_stage ON contacts
+    WHEN OLD.contact_stage IS NOT NEW.contact_stage BEGIN
+      INSERT INTO contact_stage_history (contact_id, from_stage, to_stage) VALUES (NEW.id, OLD.contact_stage, NEW.contact_stage);
+    END;
+    """)
+    if conn.execute("SELECT 1 FROM contact_stage_history LIMIT 1").fetchone() is None:
+        with conn:
+            conn.execute("""
+            WITH moves AS (
+              SELECT a.id, a.contact_id, a.ts,
+                     substr(a.details, instr(a.details,'<b>') + 3, instr(a.details,'</b>') - instr(a.details,'<b>') - 3) AS to_stage
+              FROM activity_log a JOIN contacts ct ON ct.id=a.contact_id
+              WHERE a.type='contact_stage_drag' AND instr(a.details,'<b>') > 0
+            )
+            INSERT INTO contact_stage_history (contact_id, from_stage, to_stage, ts)
+            SELECT contact_id, from_stage, to_stage, ts FROM (
+              SELECT ct.id AS contact_id, NULL AS from_stage, ct.contact_stage AS to_stage,
+                     IFNULL(ct.created_at, CURRENT_TIMESTAMP) AS ts, 0 AS seq
+              FROM contacts ct WHERE NOT EXISTS (SELECT 1 FROM moves m WHERE m.contact_id=ct.id)
+              UNION ALL
+              SELECT ct.id, NULL, 'Contato Inicial', MIN(IFNULL(ct.created_at, f.ts), f.ts), 0
+              FROM contacts ct JOIN (SELECT contact_id, MIN(ts) AS ts FROM moves GROUP BY contact_id) f ON f.contact_id=ct.id
+              UNION ALL
+              SELECT contact_id, LAG(to_stage, 1, 'Contato Inicial') OVER (PARTITION BY contact_id ORDER BY ts, id), to_stage, ts, id
+              FROM moves
+            ) ORDER BY ts, seq""")
+    conn.commit()
+    stage_history.refresh_rollups(conn)
+
+# padrão: <base>_archive.db ao lado de DB_FILE (crm_v4.db -> crm_v4_archive.db)
+ACTIVITY_ARCHIVE_FILE = os.environ.get("CRM_ACTIVITY_ARCHIVE")
+ACTIVITY_LOG_DDL = """CREATE TABLE IF NOT EXISTS {schema}activity_log (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
         ts TEXT DEFAULT CURRENT_TIMESTAMP,
         type TEXT,
         company_id INTEGER,
         contact_id INTEGER,
         details TEXT
-    )""")
+    )"""
+
+def ensure_activity_log(conn):
+    conn.execute(ACTIVITY_LOG_DDL.format(schema=""))
+    conn.executescript("""
+    CREATE INDEX IF NOT EXISTS idx_activity_company_ts ON activity_log(company_id, ts);
+    CREATE INDEX IF NOT EXISTS idx_activity_contact_ts ON activity_log(contact_id, ts);
+    CREATE INDEX IF NOT EXISTS idx_activity_ts ON activity_log(ts);
+    -- eventos compactados: um contador por dia/empresa/tipo (company_id 0 = sem empresa)
+    CREATE TABLE IF NOT EXISTS activity_daily (
+      day TEXT NOT NULL,
+      company_id INTEGER NOT NULL,
+      type TEXT NOT NULL,
+      n INTEGER NOT NULL DEFAULT 0,
+      PRIMARY KEY (company_id, day, type)
+    ) WITHOUT ROWID;
+    """)
+
+def compact_activity_log(conn, retention_days, archive_file=None):
+    """Move eventos mais antigos que `retention_days` para o arquivo de archive
+    (ATTACH) e acumula contagens diárias por empresa em activity_daily."""
+    cutoff = (datetime.datetime.now(datetime.timezone.utc)
+              - datetime.timedelta(days=int(retention_days))).strftime("%Y-%m-%d %H:%M:%S")
+    archive_file = archive_file or ACTIVITY_ARCHIVE_FILE or os.path.splitext(DB_FILE)[0] + "_archive.db"
+    conn.execute("ATTACH DATABASE ? AS archive", (archive_file,))
+    try:
+        conn.execute(ACTIVITY_LOG_DDL.format(schema="archive."))
+        with conn:
+            conn.execute("""INSERT INTO activity_daily (day, company_id, type, n)
+                            SELECT date(ts), IFNULL(company_id,0), IFNULL(type,''), COUNT(*)
+                            FROM main.activity_log WHERE ts < ?
+                            GROUP BY 1, 2, 3
+                            ON CONFLICT(company_id, day, type) DO UPDATE SET n = n + excluded.n""", (cutoff,))
+            archived = conn.execute("""INSERT INTO archive.activity_log (id, ts, type, company_id, contact_id, details)
+                                       SELECT id, ts, type, company_id, contact_id, details
+                                       FROM main.activity_log WHERE ts < ?""", (cutoff,)).rowcount
+            conn.execute("DELETE FROM main.activity_log WHERE ts < ?", (cutoff,))
+    finally:
+        conn.execute("DETACH DATABASE archive")
+    return {"cutoff": cutoff, "archived": archived, "archive_file": archive_file}
+
+# Índices FTS5 (external content) sobre companies/contacts; remove_diacritics
+# faz "reuniao" casar com "Reunião", equivalente a _norm().
+SEARCH_TOKENIZE = "unicode61 remove_diacritics 2"
+SEARCH_FTS = {
+    "companies_fts": ("companies", ["name", "category", "subcategory", "city", "notes"]),
+    "contacts_fts": ("contacts", ["name", "role", "email", "notes"]),
+}
+
+def ensure_search_index(conn):
+    existing = {r["name"] for r in conn.execute("SELECT name FROM sqlite_master WHERE type='table'")}
+    for fts, (table, cols) in SEARCH_FTS.items():
+        collist = ", ".join(cols)
+        new_vals = ", ".join(f"NEW.{c}" for c in cols)
+        old_vals = ", ".join(f"OLD.{c}" for c in cols)
+        conn.executescript(f"""
+        CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5(
+          {collist}, content='{table}', content_rowid='id', tokenize='{SEARCH_TOKENIZE}', prefix='2 3');
+        CREATE TRIGGER IF NOT EXISTS trg_{fts}_ins AFTER INSERT ON {table} BEGIN
+          INSERT INTO {fts}(rowid, {collist}) VALUES (NEW.id, {new_vals});
+        END;
+        CREATE TRIGGER IF NOT EXISTS trg_{fts}_del AFTER DELETE ON {table} BEGIN
+          INSERT INTO {fts}({fts}, rowid, {collist}) VALUES ('delete', OLD.id, {old_vals});
+        END;
+        CREATE TRIGGER IF NOT EXISTS trg_{fts}_upd AFTER UPDATE OF {collist} ON {table} BEGIN
+          INSERT INTO {fts}({fts}, rowid, {collist}) VALUES ('delete', OLD.id, {old_vals});
+          INSERT INTO {fts}(rowid, {collist}) VALUES (NEW.id, {new_vals});
+        END;
+        """)
+        if fts not in existing:
+            conn.execute(f"INSERT INTO {fts}({fts}) VALUES ('rebuild')")
+    conn.commit()
+
+ASYNC_LOG = os.environ.get("CRM_ASYNC_LOG", "0") == "1"
+LOG_FLUSH_SECONDS = float(os.environ.get("CRM_LOG_FLUSH_SECONDS", "1"))
+LOG_FLUSH_MAX = 500
+
+class ActivityLogWriter(threading.Thread):
+    """Grava activity_log fora do request: junta eventos por até LOG_FLUSH_SECONDS
+    e insere com um executemany numa conexão própria."""
+    def __init__(self, interval=LOG_FLUSH_SECONDS, max_batch=LOG_FLUSH_MAX):
+        super().__init__(name="activity-log-writer", daemon=True)
+        self.interval = interval
+        self.max_batch = max_batch
+        self.queue = queue.Queue()
+        self._stopping = threading.Event()
+        self.stats = {"queued": 0, "written": 0, "flushes": 0, "errors": 0, "lost": 0}
+
+    def put(self, row):
+        self.stats["queued"] += 1
+        self.queue.put(row)
+
+    def run(self):
+        conn = _connect()
+        try:
+            while not (self._stopping.is_set() and self.queue.empty()):
+                try:
+                    batch = [self.queue.get(timeout=0.5)]
+                except queue.Empty:
+                    continue
+                deadline = time.monotonic() + (0 if self._stopping.is_set() else self.interval)
+                while len(batch) < self.max_batch:
+                    try:
+                        batch.append(self.queue.get(timeout=max(0.0, deadline - time.monotonic())))
+                    except queue.Empty:
+                        break
+                try:
+                    with conn:
+                        conn.executemany("INSERT INTO activity_log (ts,type,company_id,contact_id,details) VALUES (?,?,?,?,?)", batch)
+                    self.stats["written"] += len(batch); self.stats["flushes"] += 1
+                except sqlite3.Error as e:
+                    # o lote inteiro se perde: conta em log_stats["failed"] (métrica exposta)
+                    self.stats["errors"] += 1; self.stats["lost"] += len(batch)
+                    log_stats["failed"] += len(batch)
+                    log_stats["last_error"] = f"{type(e).__name__}: {e}"
+                    app.logger.warning("activity log: %d eventos perdidos: %s", len(batch), e)
+        finally:
+            conn.close()
+
+    def stop(self, timeout=5.0):
+        self._stopping.set()
+        self.join(timeout)
+
+log_writer = None
+log_stats = {"written": 0, "failed": 0, "last_error": None}
+
+def start_log_writer():
+    global log_writer
+    if log_writer is None:
+        log_writer = ActivityLogWriter()
+        log_writer.start()
+        atexit.register(log_writer.stop)
+    return log_writer
 
 def log_event(conn, type_, company_id=None, contact_id=None, details=""):
+    if log_writer is not None:
+        ts = datetime.datetime.now(datetime.timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+        log_writer.put((ts, type_, company_id, contact_id, details))
+        return
     try:
         conn.execute("INSERT INTO activity_log (type,company_id,contact_id,details) VALUES (?,?,?,?)",
                      (type_, company_id, contact_id, details))
-    except Exception:
-        pass
+        log_stats["written"] += 1
+    except Exception as e:
+        # o log não pode derrubar a operação principal, mas a falha fica visível
+        log_stats["failed"] += 1
+        log_stats["last_error"] = f"{type(e).__name__}: {e}"
+        app.logger.warning("log_event(%s) falhou: %s", type_, e)
 
-def init_db():
-    conn = get_db()
+# ============== Schema / migrações ==============
+def _migrate_base(conn):
     conn.executescript("""
     PRAGMA foreign_keys = ON;
     CREATE TABLE IF NOT EXISTS companies (
@@ -129,8 +622,13 @@ def init_db():
       created_at TEXT DEFAULT CURRENT_TIMESTAMP,
       updated_at TEXT DEFAULT CURRENT_TIMESTAMP
     );
-    CREATE INDEX IF NOT EXISTS idx_contacts_company ON contacts(company_id);
+    -- funil do dashboard só pelo índice; o antigo idx_contacts_company é prefixo deste
+    CREATE INDEX IF NOT EXISTS idx_contacts_company_stage ON contacts(company_id, contact_stage);
+    DROP INDEX IF EXISTS idx_contacts_company;
     CREATE INDEX IF NOT EXISTS idx_contacts_stage ON contacts(contact_stage);
+    CREATE INDEX IF NOT EXISTS idx_contacts_board ON contacts(contact_stage, priority, company_id);
+    CREATE INDEX IF NOT EXISTS idx_companies_base ON companies(reg_status_base);
+    CREATE INDEX IF NOT EXISTS idx_companies_cat ON companies(category, subcategory);
 
     CREATE TABLE IF NOT EXISTS tasks (
       id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -147,6 +645,8 @@ def init_db():
     );
     CREATE INDEX IF NOT EXISTS idx_tasks_company ON tasks(company_id);
     CREATE INDEX IF NOT EXISTS idx_tasks_due ON tasks(due_date);
+    -- tarefas abertas por data (dashboard: atrasadas / próximos 7 dias)
+    CREATE INDEX IF NOT EXISTS idx_tasks_open_due ON tasks(due_date) WHERE done=0;
 
     CREATE TABLE IF NOT EXISTS opportunities (
       id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -164,12 +664,29 @@ def init_db():
     );
     CREATE INDEX IF NOT EXISTS idx_opps_company ON opportunities(company_id);
     CREATE INDEX IF NOT EXISTS idx_opps_stage ON opportunities(stage);
+
+    CREATE TABLE IF NOT EXISTS settings (id INTEGER PRIMARY KEY CHECK (id=1), json TEXT, rev INTEGER NOT NULL DEFAULT 0);
+
+    -- status efetivo materializado (mantido por triggers, ver rebuild_company_status)
+    CREATE TABLE IF NOT EXISTS company_status (
+      company_id INTEGER PRIMARY KEY,
+      active_contacts INTEGER NOT NULL DEFAULT 0,
+      inactive_contacts INTEGER NOT NULL DEFAULT 0,
+      reg_status_effective TEXT GENERATED ALWAYS AS (
+        CASE WHEN active_contacts > 0 THEN 'Ativo' WHEN inactive_contacts > 0 THEN 'Inativo' END
+      ) VIRTUAL
+    );
+    CREATE INDEX IF NOT EXISTS idx_company_status_eff ON company_status(reg_status_effective);
+    CREATE TABLE IF NOT EXISTS company_status_totals (status TEXT PRIMARY KEY, n INTEGER NOT NULL DEFAULT 0);
+    DROP VIEW IF EXISTS company_status_view;
+    CREATE VIEW company_status_view AS
+      SELECT c.id, c.name, c.reg_status_base, s.reg_status_effective
+      FROM companies c LEFT JOIN company_status s ON s.company_id = c.id;
     """)
-    # settings + view + activity log
-    cfg = load_settings(conn)
-    save_settings(conn, cfg)
-    rebuild_company_status_view(conn, cfg)
-    ensure_activity_log(conn)
+    if "rev" not in [r["name"] for r in conn.execute("PRAGMA table_info(settings)")]:
+        conn.execute("ALTER TABLE settings ADD COLUMN rev INTEGER NOT NULL DEFAULT 0")
+    invalidate_settings_cache()
+    save_settings(conn, load_settings(conn))
 
     # users table
     conn.execute("""CREATE TABLE IF NOT EXISTS users (
@@ -180,12 +697,64 @@ def init_db():
       role TEXT DEFAULT 'sales',
       api_token TEXT
     )""")
+    conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_users_api_token ON users(api_token)")
     # seed admin if empty
     row = conn.execute("SELECT COUNT(*) c FROM users").fetchone()
     if row and row["c"] == 0:
-        conn.execute("INSERT INTO users (name,email,pwd_hash,role) VALUES (?,?,?,?)",
+        conn.execute("INSERT OR IGNORE INTO users (name,email,pwd_hash,role) VALUES (?,?,?,?)",
                      ("Admin", "admin@example.com", generate_password_hash("admin"), "admin"))
-    conn.commit(); conn.close()
+    conn.commit()
+
+# Em ordem; cada passo roda uma vez por base (schema_migrations) e é idempotente,
+# então bases antigas sem a tabela de controle passam por todos sem efeito colateral.
+MIGRATIONS = [
+    (1, "base", _migrate_base),
+    (2, "company_status", lambda conn: rebuild_company_status(conn, load_settings(conn))),
+    (3, "activity_log", ensure_activity_log),
+    (4, "search_fts", ensure_search_index),
+    (5, "task_dates", normalize_task_dates),
+    (6, "data_revisions", lambda conn: ensure_revision_triggers(conn, REVISION_TABLES)),
+    (7, "board_events", ensure_board_events),
+    (8, "stage_history", ensure_stage_history),
+]
+
+MIGRATE_LOCK_TIMEOUT = 600  # segundos; migração numa base de 1M linhas leva minutos
+
+def migrate(conn, force=False):
+    """Aplica as migrações pendentes; devolve as versões aplicadas.
+    force=True reaplica todas (ex.: depois de um bulk load sem triggers)."""
+    # Workers do gunicorn sobem juntos e todos chamam init_db. As migrações fazem
+    # commit no meio, então a trava entre processos é um BEGIN EXCLUSIVE num
+    # arquivo SQLite ao lado da base; quem chega depois espera e relê
+    # schema_migrations já com a trava na mão.
+    lock = sqlite3.connect(DB_FILE + ".migrate-lock", timeout=MIGRATE_LOCK_TIMEOUT, isolation_level=None)
+    try:
+        lock.execute("BEGIN EXCLUSIVE")
+        conn.execute("""CREATE TABLE IF NOT EXISTS schema_migrations (
+          version INTEGER PRIMARY KEY, name TEXT, applied_at TEXT DEFAULT CURRENT_TIMESTAMP)""")
+        conn.commit()
+        done = set() if force else {r["version"] for r in conn.execute("SELECT version FROM schema_migrations")}
+        applied = []
+        for version, name, fn in MIGRATIONS:
+            if version in done: continue
+            fn(conn)
+            with conn:
+                conn.execute("INSERT OR REPLACE INTO schema_migrations (version, name) VALUES (?,?)", (version, name))
+            applied.append(version)
+        return applied
+    finally:
+        lock.close()  # fecha = rollback = solta a trava
+
+def init_db(force=False):
+    conn = get_db()
+    try:
+        applied = migrate(conn, force)
+    finally:
+        if not has_app_context(): conn.close()
+    invalidate_settings_cache()
+    if ASYNC_LOG:
+        start_log_writer()
+    return applied
 
 # -------------- Auth setup --------------
 login_manager = LoginManager(app)
@@ -199,12 +768,107 @@ class User(UserMixin):
         self.role = row["role"]
         self.api_token = row["api_token"]
 
+USER_CACHE_SIZE = 1024
+USER_CACHE_TTL = float(os.environ.get("CRM_USER_CACHE_TTL", "60"))
+
+class UserCache:
+    """LRU com TTL para User. Chaves: ("id", user_id) e ("token", sha256 do token).
+    Outros workers enxergam alterações em users em até `ttl` segundos."""
+    def __init__(self, maxsize=USER_CACHE_SIZE, ttl=USER_CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = self.misses = 0
+
+    def get(self, key):
+        now = time.monotonic()
+        with self._lock:
+            hit = self._data.get(key)
+            if hit and now - hit[0] < self.ttl:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return hit[1]
+            if hit:
+                del self._data[key]
+            self.misses += 1
+            return None
+
+    def put(self, key, user):
+        with self._lock:
+            self._data[key] = (time.monotonic(), user)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def invalidate(self, user_id=None):
+        with self._lock:
+            if user_id is None:
+                self._data.clear()
+            else:
+                for k in [k for k, (_, u) in self._data.items() if u.id == user_id]:
+                    del self._data[k]
+
+    def snapshot(self):
+        total = self.hits + self.misses
+        return {"size": len(self._data), "maxsize": self.maxsize, "ttl": self.ttl,
+                "hits": self.hits, "misses": self.misses,
+                "hit_rate": round(self.hits / total, 3) if total else 0.0}
+
+user_cache = UserCache()
+
+def _token_hash(token):
+    return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+def issue_api_token(conn, user_id):
+    """Gera um token novo para o usuário; só o hash fica em users.api_token."""
+    token = secrets.token_urlsafe(32)
+    with conn:
+        conn.execute("UPDATE users SET api_token=? WHERE id=?", (_token_hash(token), user_id))
+    user_cache.invalidate(user_id)
+    return token
+
 @login_manager.user_loader
 def load_user(user_id):
-    conn = get_db()
-    row = conn.execute("SELECT * FROM users WHERE id=?", (user_id,)).fetchone()
-    conn.close()
-    return User(row) if row else None
+    key = ("id", str(user_id))
+    user = user_cache.get(key)
+    if user is None:
+        row = get_db().execute("SELECT * FROM users WHERE id=?", (user_id,)).fetchone()
+        if not row: return None
+        user = User(row)
+        user_cache.put(key, user)
+    return user
+
+@login_manager.request_loader
+def load_user_from_token(req):
+    """Authorization: Bearer <token> para clientes de script (sem cookie de sessão).
+    O token é procurado pelo sha256 (users.api_token guarda só o hash): quem não
+    tem o token não consegue montar o hash, então não há comparação de segredo
+    em Python que precise ser em tempo constante."""
+    auth = req.headers.get("Authorization", "")
+    if not auth.lower().startswith("bearer "):
+        return None
+    token = auth[7:].strip()
+    if not token:
+        return None
+    digest = _token_hash(token)
+    key = ("token", digest)
+    user = user_cache.get(key)
+    if user is None:
+        row = get_db().execute("SELECT * FROM users WHERE api_token=?", (digest,)).fetchone()
+        if not row: return None
+        user = User(row)
+        user_cache.put(key, user)
+    return user
+
+@login_manager.unauthorized_handler
+def unauthorized():
+    """Cliente de script (Authorization presente, token inválido/expirado) recebe
+    401 em JSON; navegador vai para o login como antes."""
+    if request.headers.get("Authorization"):
+        return jsonify({"ok":False,"error":"não autenticado"}),401
+    flash(login_manager.login_message, login_manager.login_message_category)
+    return redirect(url_for("login", next=request.url))
 
 def role_required(*roles):
     def deco(fn):
@@ -213,6 +877,8 @@ def role_required(*roles):
             if not current_user.is_authenticated:
                 return login_manager.unauthorized()
             if current_user.role not in roles:
+                if request.headers.get("Authorization"):
+                    return jsonify({"ok":False,"error":"sem permissão"}),403
                 flash("Sem permissão.", "danger")
                 return redirect(url_for("dashboard"))
             return fn(*a, **kw)
@@ -239,6 +905,78 @@ def apply_sorting(base_sql, allowed, default_col, default_dir="asc"):
     if direction not in ("asc","desc"): direction = default_dir
     return f"{base_sql} ORDER BY {sort} {direction}", sort, direction
 
+# -------------- HTTP cache & compressão --------------
+# Muda quando o código ou um template muda (igual entre workers do mesmo deploy)
+_TEMPLATE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "templates")
+ETAG_SALT = os.environ.get("CRM_ETAG_SALT") or str(max(
+    [os.path.getmtime(os.path.abspath(__file__))] +
+    [os.path.getmtime(os.path.join(_TEMPLATE_DIR, f)) for f in (os.listdir(_TEMPLATE_DIR) if os.path.isdir(_TEMPLATE_DIR) else [])]))
+
+def conditional(*tables, daily=False):
+    """ETag/Last-Modified a partir de data_revisions das `tables`. Se o cliente já tem
+    a versão atual responde 304 sem chamar a view (nenhuma agregação roda).
+    daily=True para páginas que dependem do dia (tarefas atrasadas etc.).
+    A view encontra as revisões em g.data_rev e o dia da ETag em g.today, para
+    usar como chave de cache e nas consultas (mesma data local nos dois)."""
+    def deco(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            conn = get_db()
+            revs, changed = data_revisions(conn, list(tables))
+            g.data_rev = tuple(revs.get(t, 0) for t in tables)
+            g.today = today = datetime.date.today()
+            if request.method != "GET" or session.get("_flashes"):
+                return fn(*args, **kwargs)
+            key = [ETAG_SALT, request.full_path, current_user.get_id(), getattr(current_user, "role", ""), g.data_rev]
+            if daily:
+                key.append(today.isoformat())
+                changed = max(changed, time.mktime(today.timetuple()))
+            etag = hashlib.sha1(repr(key).encode()).hexdigest()[:20]
+            last_modified = datetime.datetime.fromtimestamp(int(changed), datetime.timezone.utc) if changed else None
+            if request.if_none_match:
+                fresh = request.if_none_match.contains_weak(etag)
+            else:
+                ims = request.if_modified_since
+                fresh = bool(ims and last_modified and last_modified <= ims)
+            if fresh:
+                resp = Response(status=304)
+            else:
+                resp = make_response(fn(*args, **kwargs))
+                if resp.status_code != 200:
+                    return resp
+            resp.set_etag(etag, weak=True)  # fraca: o corpo pode sair comprimido
+            if last_modified: resp.last_modified = last_modified
+            resp.headers["Cache-Control"] = "private, no-cache"
+            return resp
+        return wrapper
+    return deco
+
+try:
+    import brotli
+except ImportError:  # opcional; sem ele fica só gzip
+    brotli = None
+
+COMPRESS_MIN_BYTES = int(os.environ.get("CRM_COMPRESS_MIN_BYTES", "1024"))
+COMPRESS_MIMETYPES = {"text/html", "application/json", "text/css", "application/javascript", "text/javascript"}
+
+@app.after_request
+def compress_response(resp):
+    """gzip/brotli para HTML/JSON grandes (board, listas, dashboards). Respostas em
+    streaming e arquivos (exports, static via send_file) passam direto."""
+    if (resp.status_code != 200 or resp.direct_passthrough or resp.is_streamed
+            or resp.mimetype not in COMPRESS_MIMETYPES or "Content-Encoding" in resp.headers):
+        return resp
+    resp.vary.add("Accept-Encoding")
+    accept = request.accept_encodings
+    body = resp.get_data()
+    if len(body) < COMPRESS_MIN_BYTES:
+        return resp
+    if brotli is not None and accept["br"]:
+        resp.set_data(brotli.compress(body, quality=5)); resp.headers["Content-Encoding"] = "br"
+    elif accept["gzip"]:
+        resp.set_data(gzip.compress(body, compresslevel=6)); resp.headers["Content-Encoding"] = "gzip"
+    return resp
+
 # -------------- Login routes --------------
 @app.route("/login", methods=["GET","POST"])
 def login():
@@ -247,7 +985,6 @@ def login():
         pwd = request.form.get("password","")
         conn = get_db()
         row = conn.execute("SELECT * FROM users WHERE LOWER(email)=?", (email,)).fetchone()
-        conn.close()
         if row and check_password_hash(row["pwd_hash"], pwd):
             login_user(User(row))
             flash("Bem-vindo!", "success")
@@ -269,32 +1006,12 @@ def root():
 # ---- Dashboard geral ----
 @app.route("/dashboard")
 @login_required
+@conditional("companies", "contacts", "tasks", "settings", daily=True)
 def dashboard():
     conn = get_db()
     cfg = load_settings(conn)
-    eff = conn.execute("""SELECT reg_status_effective AS k, COUNT(*) c
-                          FROM company_status_view WHERE reg_status_effective IS NOT NULL
-                          GROUP BY reg_status_effective""").fetchall()
-    eff_map = {r["k"]: r["c"] for r in eff}
-    base = conn.execute("SELECT reg_status_base AS k, COUNT(*) c FROM companies GROUP BY reg_status_base").fetchall()
-    base_map = {r["k"]: r["c"] for r in base}
-    by_stage = conn.execute("SELECT contact_stage AS k, COUNT(*) c FROM contacts GROUP BY contact_stage").fetchall()
-    stg_map = {r["k"]: r["c"] for r in by_stage}
-    overdue = conn.execute("""
-        SELECT t.*, co.name AS company_name, ct.name AS contact_name
-        FROM tasks t JOIN companies co ON co.id=t.company_id
-        LEFT JOIN contacts ct ON ct.id=t.contact_id
-        WHERE IFNULL(t.done,0)=0 AND IFNULL(t.due_date,'')<>'' AND date(t.due_date) < date('now')
-        ORDER BY date(t.due_date) ASC LIMIT 30""").fetchall()
-    next7 = conn.execute("""
-        SELECT t.*, co.name AS company_name, ct.name AS contact_name
-        FROM tasks t JOIN companies co ON co.id=t.company_id
-        LEFT JOIN contacts ct ON ct.id=t.contact_id
-        WHERE IFNULL(t.done,0)=0 AND IFNULL(t.due_date,'')<>'' AND date(t.due_date) BETWEEN date('now') AND date('now','+7 day')
-        ORDER BY date(t.due_date) ASC LIMIT 30""").fetchall()
-    total_companies = conn.execute("SELECT COUNT(*) c FROM companies").fetchone()["c"]
-    total_contacts = conn.execute("SELECT COUNT(*) c FROM contacts").fetchone()["c"]
-    conn.close()
+    st = dashboard_cache.get("general", (g.data_rev, g.today), lambda: dashboard_stats.general_stats(conn, g.today))
+    eff_map, base_map, stg_map = st["eff_map"], st["base_map"], st["stage_map"]
 
     eff_labels = ["Ativo","Inativo"]
     eff_counts = [int(eff_map.get("Ativo",0)), int(eff_map.get("Inativo",0))]
@@ -303,31 +1020,24 @@ def dashboard():
     contact_labels = cfg["contact_stages"]
     contact_counts = [int(stg_map.get(x,0)) for x in contact_labels]
 
-    kpis = {"empresas": int(total_companies), "contatos": int(total_contacts),
+    kpis = {"empresas": int(st["total_companies"]), "contatos": int(st["total_contacts"]),
             "ativos": int(eff_map.get("Ativo",0)), "inativos": int(eff_map.get("Inativo",0))}
 
     return render_template("dashboard.html",
                            eff_labels=eff_labels, eff_counts=eff_counts,
                            base_labels=base_labels, base_counts=base_counts,
                            contact_labels=contact_labels, contact_counts=contact_counts,
-                           overdue=overdue, next7=next7, kpis=kpis)
+                           overdue=st["overdue"], next7=st["next7"], kpis=kpis)
 
 # ---- Dashboard Empresas ----
 @app.route("/dashboard_companies")
 @login_required
+@conditional("companies", "contacts")
 def dashboard_companies():
     conn = get_db()
-    total = conn.execute("SELECT COUNT(*) c FROM companies").fetchone()["c"]
-    mapeados = conn.execute("SELECT COUNT(DISTINCT co.id) c FROM companies co JOIN contacts ct ON ct.company_id=co.id").fetchone()["c"]
-    acionados = conn.execute("""SELECT COUNT(DISTINCT co.id) c FROM companies co JOIN contacts ct ON ct.company_id=co.id
-                                WHERE ct.contact_stage <> 'Contato Inicial'""").fetchone()["c"]
-    retorno_pos = conn.execute("""SELECT COUNT(DISTINCT co.id) c FROM companies co JOIN contacts ct ON ct.company_id=co.id
-                                  WHERE ct.contact_stage IN ('Reunião Marcada','Projeto Ganho')""").fetchone()["c"]
-    potencial_imediato = conn.execute("""SELECT COUNT(DISTINCT co.id) c FROM companies co JOIN contacts ct ON ct.company_id=co.id
-                                         WHERE ct.contact_stage IN ('Marcar Reunião','Reunião Marcada','Acompanhar')""").fetchone()["c"]
-    by_cat = conn.execute("SELECT IFNULL(category,'') k, COUNT(*) c FROM companies GROUP BY IFNULL(category,'') ORDER BY c DESC").fetchall()
-    by_sub = conn.execute("SELECT IFNULL(subcategory,'') k, COUNT(*) c FROM companies GROUP BY IFNULL(subcategory,'') ORDER BY c DESC LIMIT 20").fetchall()
-    conn.close()
+    st = dashboard_cache.get("companies", g.data_rev, lambda: dashboard_stats.company_stats(conn))
+    total, mapeados, acionados = st["total"], st["mapeados"], st["acionados"]
+    retorno_pos, potencial_imediato = st["retorno_pos"], st["potencial_imediato"]
 
     def perc(part, base): return 0 if not base else round(100*part/base,1)
     kpi = {
@@ -339,10 +1049,19 @@ def dashboard_companies():
     }
     return render_template("dashboard_companies.html",
                            kpi=kpi,
-                           cat_labels=[r["k"] or "(sem categoria)" for r in by_cat],
-                           cat_counts=[int(r["c"]) for r in by_cat],
-                           sub_labels=[r["k"] or "(sem subcategoria)" for r in by_sub],
-                           sub_counts=[int(r["c"]) for r in by_sub])
+                           cat_labels=[k or "(sem categoria)" for k, _ in st["by_cat"]],
+                           cat_counts=[int(c) for _, c in st["by_cat"]],
+                           sub_labels=[k or "(sem subcategoria)" for k, _ in st["by_sub"]],
+                           sub_counts=[int(c) for _, c in st["by_sub"]])
+
+@app.route("/dashboard/timings.json")
+@login_required
+def dashboard_timings():
+    """Tempo (ms) de cada bloco de KPI, calculado agora (sem cache)."""
+    conn = get_db()
+    return jsonify({"general": dashboard_stats.general_stats(conn)["timings"],
+                    "companies": dashboard_stats.company_stats(conn)["timings"],
+                    "cache": {"ttl": dashboard_cache.ttl, "hits": dashboard_cache.hits, "misses": dashboard_cache.misses}})
 
 # ---- Settings ----
 @app.route("/settings", methods=["GET","POST"])
@@ -354,10 +1073,16 @@ def settings():
         base = [x.strip() for x in request.form.get("company_base_statuses","").split(",") if x.strip()]
         stages = [x.strip() for x in request.form.get("contact_stages","").split(",") if x.strip()]
         inactive = [x.strip() for x in request.form.get("inactive_stages","").split(",") if x.strip()]
+        old_inactive = cfg["inactive_stages"]
         if base: cfg["company_base_statuses"] = base
         if stages: cfg["contact_stages"] = stages
         if inactive: cfg["inactive_stages"] = inactive
-        save_settings(conn, cfg); rebuild_company_status_view(conn, cfg)
+        retention = request.form.get("activity_retention_days","").strip()
+        if retention.isdigit() and int(retention) > 0: cfg["activity_retention_days"] = int(retention)
+        save_settings(conn, cfg)
+        if cfg["inactive_stages"] != old_inactive:
+            rebuild_company_status(conn, cfg)
+        dashboard_cache.invalidate()
         flash("Configurações salvas.", "success")
         return redirect(url_for("settings"))
     return render_template("settings.html", cfg=cfg)
@@ -372,60 +1097,816 @@ def settings_wipe():
         conn.execute("DELETE FROM companies")
         conn.execute("DELETE FROM opportunities")
         conn.execute("DELETE FROM activity_log")
-    rebuild_company_status_view(conn, load_settings(conn))
+        conn.execute("DELETE FROM activity_daily")
+        for t in ("contact_stage_history", "stage_daily", "stage_transition_daily", "stage_rollup_state"):
+            conn.execute(f"DELETE FROM {t}")
+        # depois dos contatos (o trigger de delete grava um evento por contato)
+        conn.execute("DELETE FROM board_events")
+    rebuild_company_status(conn, load_settings(conn))
+    dashboard_cache.invalidate()
     flash("Base limpa.", "warning")
     return redirect(url_for("settings"))
 
 # -------------------- Board (simples) --------------------
+BOARD_PAGE = 50
+BOARD_MAX_PAGE = 200
+# chave de ordenação dos cards (também é o cursor de paginação de cada coluna)
+BOARD_ORDER = "IFNULL(ct.priority, -1), co.name, ct.name, ct.id"
+
+def _board_card(r):
+    return {"id": r["id"], "name": r["name"], "company_name": r["company_name"]}
+
+def _board_cursor(r):
+    return json.dumps([r["sort_priority"], r["company_name"], r["name"], r["id"]], ensure_ascii=False)
+
 @app.route("/board")
 @login_required
+@conditional("contacts", "companies", "settings")
 def board():
     conn=get_db()
     cfg = load_settings(conn)
     stages=cfg["contact_stages"]
-    columns={}
-    for s in stages:
-        rows=conn.execute("""SELECT ct.id, ct.name, co.name AS company_name
-                             FROM contacts ct JOIN companies co ON co.id=ct.company_id
-                             WHERE ct.contact_stage=? ORDER BY ct.priority, co.name, ct.name""",(s,)).fetchall()
-        columns[s]=rows or []
-    conn.close()
-    return render_template("board.html", columns=columns, stages=stages)
+    columns={s: [] for s in stages}; totals={s: 0 for s in stages}; cursors={}
+    # um LIMIT por coluna (top-N) em vez de janela sobre todos os contatos:
+    # co.name vem do JOIN, então o índice não entrega a ordem, mas cada coluna
+    # só mantém BOARD_PAGE linhas no sort
+    column = f"""SELECT * FROM (
+          SELECT ct.id, ct.name, ct.contact_stage, co.name AS company_name,
+                 IFNULL(ct.priority, -1) AS sort_priority,
+                 (SELECT COUNT(*) FROM contacts WHERE contact_stage=?) AS total
+          FROM contacts ct JOIN companies co ON co.id=ct.company_id
+          WHERE ct.contact_stage=? ORDER BY {BOARD_ORDER} LIMIT ?)"""
+    rows=conn.execute(f"""
+        SELECT *, ROW_NUMBER() OVER (PARTITION BY contact_stage ORDER BY sort_priority, company_name, name, id) AS rn,
+               (SELECT MAX(id) FROM board_events) AS last_event
+        FROM ({" UNION ALL ".join([column] * len(stages))})
+        ORDER BY contact_stage, rn""", [p for st in stages for p in (st, st, BOARD_PAGE)]).fetchall()
+    # mesmo statement = mesmo snapshot: o stream continua exatamente daqui
+    last_event = rows[0]["last_event"] if rows else conn.execute("SELECT MAX(id) FROM board_events").fetchone()[0]
+    for r in rows:
+        s = r["contact_stage"]
+        columns[s].append(_board_card(r)); totals[s] = r["total"]
+        if r["rn"] == BOARD_PAGE and r["total"] > BOARD_PAGE:
+            cursors[s] = _board_cursor(r)
+    return render_template("board.html", columns=columns, stages=stages, totals=totals, cursors=cursors,
+                           last_event=last_event or 0)
+
+@app.route("/board/column")
+@login_required
+@conditional("contacts", "companies")
+def board_column():
+    """Próxima página de uma coluna do board (keyset: cursor = último card recebido)."""
+    stage = request.args.get("stage", "")
+    try:
+        limit = max(1, min(int(request.args.get("limit", BOARD_PAGE)), BOARD_MAX_PAGE))
+        after = json.loads(request.args.get("after", "null"))
+        if after is None:
+            prio = company = name = cid = None
+        else:  # cursor = [prioridade, empresa, contato, id]
+            if not isinstance(after, list): raise TypeError
+            prio, company, name, cid = after
+            if not all(isinstance(v, str) for v in (company, name)): raise TypeError
+            prio, cid = (-1 if prio is None else int(prio)), int(cid)
+    except (ValueError, TypeError):
+        return jsonify({"ok":False,"error":"cursor inválido"}),400
+    sql = """SELECT ct.id, ct.name, co.name AS company_name, IFNULL(ct.priority, -1) AS sort_priority
+             FROM contacts ct JOIN companies co ON co.id=ct.company_id
+             WHERE ct.contact_stage=?"""
+    params = [stage]
+    if cid is not None:
+        sql += " AND (IFNULL(ct.priority, -1), co.name, ct.name, ct.id) > (?,?,?,?)"
+        params += [prio, company, name, cid]
+    rows = get_db().execute(f"{sql} ORDER BY {BOARD_ORDER} LIMIT ?", (*params, limit + 1)).fetchall()
+    more = len(rows) > limit; rows = rows[:limit]
+    return jsonify({"ok":True, "cards":[_board_card(r) for r in rows],
+                    "next": _board_cursor(rows[-1]) if more else None})
+
+# ---- Board ao vivo (SSE) ----
+# No deploy padrão (Procfile: gunicorn com workers de thread) isto é polling:
+# cada request a /board/stream manda os deltas desde Last-Event-ID e fecha, e o
+# EventSource volta em BOARD_POLL_RETRY_MS (~3 s). Push de verdade (stream
+# aberto) só com workers gevent, que não vêm no requirements nem no Procfile.
+BOARD_EVENTS_BUFFER = 1000     # eventos recentes em memória (replay por Last-Event-ID)
+BOARD_EVENTS_BATCH = 500       # acima disso numa leitura: manda "reset" (ex.: import em lote)
+BOARD_EVENTS_KEEP = 10000      # linhas mantidas em board_events
+BOARD_EVENTS_PRUNE_EVERY = 1000  # trigger de poda roda a cada N eventos
+BOARD_EVENTS_POLL = float(os.environ.get("CRM_BOARD_EVENTS_POLL", "0.5"))
+BOARD_STREAM_SECONDS = float(os.environ.get("CRM_STREAM_SECONDS", "30"))
+BOARD_STREAM_HEARTBEAT = 10
+BOARD_POLL_RETRY_MS = 3000
+# threads por processo do servidor (wsgi.serve e Procfile leem o mesmo env)
+SERVER_THREADS = int(os.environ.get("CRM_THREADS", "8"))
+
+def _green_workers():
+    """True com gunicorn -k gevent: cada stream é uma greenlet, não uma thread."""
+    monkey = sys.modules.get("gevent.monkey")
+    return bool(monkey and monkey.is_module_patched("threading"))
+
+def board_stream_cap():
+    """Quantos streams longos por processo. Em workers de thread cada stream
+    prende uma thread, então o padrão é nenhum (catch-up e fecha = polling) e
+    CRM_STREAM_MAX fica limitado a 1/4 das threads."""
+    if _green_workers():
+        return int(os.environ.get("CRM_STREAM_MAX", "500"))
+    return max(0, min(int(os.environ.get("CRM_STREAM_MAX", "0")), SERVER_THREADS // 4))
+SQL_BOARD_EVENTS = """SELECT e.id, e.contact_id, e.from_stage, e.to_stage, ct.name, co.name AS company_name
+                      FROM board_events e LEFT JOIN contacts ct ON ct.id=e.contact_id
+                      LEFT JOIN companies co ON co.id=ct.company_id
+                      WHERE e.id > ? ORDER BY e.id LIMIT ?"""
+# numa leitura só (mesmo snapshot): maior id já dado e maior id ainda na tabela
+SQL_BOARD_EVENTS_SEQ = """SELECT seq, (SELECT MAX(id) FROM board_events) FROM sqlite_sequence
+                          WHERE name='board_events'"""
+
+class BoardEventBus(threading.Thread):
+    """Pub/sub em processo para /board/stream. Uma thread (com uma conexão) lê
+    board_events e guarda os eventos recentes num buffer circular único; cada
+    stream só lembra o último id que enviou e espera na Condition, então um
+    cliente ocioso não custa conexão SQLite nem fila própria."""
+    def __init__(self, buffer=BOARD_EVENTS_BUFFER, poll=BOARD_EVENTS_POLL, max_streams=None):
+        super().__init__(name="board-events-relay", daemon=True)
+        self.poll = poll
+        self.max_streams = board_stream_cap() if max_streams is None else max_streams
+        self._slots = threading.BoundedSemaphore(self.max_streams)
+        self._events = collections.deque(maxlen=buffer)
+        self._cond = threading.Condition()
+        self._wake = threading.Event()
+        self._start_lock = threading.Lock()
+        self.last_id = 0   # último evento lido do banco
+        self.floor = 0     # todo evento com id > floor está no buffer
+        self.stats = {"published": 0, "resets": 0, "errors": 0, "streams_open": 0, "streams_total": 0}
+
+    def ensure_started(self):
+        with self._start_lock:
+            if self.is_alive(): return
+            self._conn = _connect()
+            top = self._conn.execute("SELECT IFNULL(MAX(id),0) FROM board_events").fetchone()[0]
+            self.floor = self.last_id = max(0, top - self._events.maxlen)
+            self._read()
+            self.start()
+
+    def open_stream(self):
+        """Reserva uma vaga de stream longo; False = cliente fica em modo polling."""
+        if not self._slots.acquire(blocking=False): return False
+        with self._cond:
+            self.stats["streams_open"] += 1; self.stats["streams_total"] += 1
+        return True
+
+    def close_stream(self):
+        with self._cond:
+            self.stats["streams_open"] -= 1
+        self._slots.release()
+
+    def poke(self):
+        """Escrita local: lê já, sem esperar o próximo poll."""
+        self._wake.set()
+
+    def _read(self):
+        rows = self._conn.execute(SQL_BOARD_EVENTS, (self.last_id, BOARD_EVENTS_BATCH + 1)).fetchall()
+        with self._cond:
+            if len(rows) > BOARD_EVENTS_BATCH:
+                top = self._conn.execute("SELECT MAX(id) FROM board_events").fetchone()[0]
+                self._events.clear()
+                self.floor = self.last_id = top
+                self.stats["resets"] += 1
+            else:
+                for r in rows:
+                    if len(self._events) == self._events.maxlen:
+                        self.floor = self._events[0][0]
+                    self._events.append((r["id"], {"id": r["contact_id"], "from": r["from_stage"], "to": r["to_stage"],
+                                                   "name": r["name"], "company_name": r["company_name"]}))
+                    self.last_id = r["id"]
+                self.stats["published"] += len(rows)
+            if rows:
+                self._cond.notify_all()
+                return
+            # nada novo: se a base foi limpa (settings_wipe apaga board_events
+            # antes de lermos), o autoincrement passou do que lemos -> reset
+            seq, top = self._conn.execute(SQL_BOARD_EVENTS_SEQ).fetchone() or (0, 0)
+            if seq > self.last_id >= (top or 0):
+                self._events.clear()
+                self.floor = self.last_id = seq
+                self.stats["resets"] += 1
+                self._cond.notify_all()
+
+    def run(self):
+        while True:
+            self._wake.wait(self.poll); self._wake.clear()
+            try:
+                self._read()
+            except sqlite3.Error as e:
+                self.stats["errors"] += 1
+                app.logger.warning("board events: %s", e)
+
+    def wait(self, after, timeout):
+        """Eventos com id > after (espera até `timeout` se não houver nenhum).
+        None quando after ficou para trás do buffer: o cliente precisa recarregar."""
+        with self._cond:
+            if after >= self.last_id and timeout > 0:
+                self._cond.wait(timeout)
+            if after < self.floor:
+                return None
+            out = []
+            for i, ev in reversed(self._events):
+                if i <= after: break
+                out.append((i, ev))
+            return out[::-1]
+
+board_bus = BoardEventBus()
+
+def _sse(data, event=None, id_=None):
+    head = (f"id: {id_}\n" if id_ is not None else "") + (f"event: {event}\n" if event else "")
+    return f"{head}data: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+@app.route("/board/stream")
+@login_required
+def board_stream():
+    """Deltas do board em SSE ({id, from, to, name, company_name} por contato).
+    Padrão (workers de thread, sem vaga): manda o que houver e fecha, e o
+    EventSource volta em `retry` ms com Last-Event-ID, ou seja, polling.
+    Com vaga (gevent, ver board_stream_cap) o stream fica aberto até
+    BOARD_STREAM_SECONDS."""
+    last = request.headers.get("Last-Event-ID") or request.args.get("last_id", "")
+    release_db(None)  # nada de conexão do pool presa durante o stream
+    board_bus.ensure_started()
+    after = int(last) if last.isdigit() else board_bus.last_id
+    held = board_bus.open_stream()
+    def gen(after=after):
+        yield f"retry: {1000 if held else BOARD_POLL_RETRY_MS}\n\n"
+        deadline = time.monotonic() + (BOARD_STREAM_SECONDS if held else 0)
+        while True:
+            remaining = deadline - time.monotonic()
+            events = board_bus.wait(after, min(BOARD_STREAM_HEARTBEAT, remaining) if remaining > 0 else 0)
+            if events is None:
+                yield _sse({}, event="reset", id_=board_bus.last_id)
+                return
+            for i, ev in events:
+                yield _sse(ev, id_=i); after = i
+            if deadline - time.monotonic() <= 0:
+                return
+            if not events:
+                yield ": ping\n\n"  # detecta cliente que saiu
+    resp = Response(gen(), mimetype="text/event-stream")
+    resp.headers["Cache-Control"] = "no-cache"
+    resp.headers["X-Accel-Buffering"] = "no"
+    if held: resp.call_on_close(board_bus.close_stream)
+    return resp
+
+MOVE_MAX_BATCH = 500
+
+def apply_moves(conn, moves):
+    """Aplica [(contact_id, stage)] numa transação; devolve quantas linhas mudaram.
+    Estágios já devem estar validados."""
+    applied = 0
+    with conn:
+        for cid, stage in moves:
+            row = conn.execute("""UPDATE contacts SET contact_stage=?, updated_at=CURRENT_TIMESTAMP
+                                  WHERE id=? AND contact_stage IS NOT ? RETURNING company_id""",
+                               (stage, cid, stage)).fetchone()
+            if row is None: continue
+            applied += 1
+            log_event(conn, 'contact_stage_drag', row["company_id"], cid, f"Estágio → <b>{stage}</b>")
+    if applied:
+        dashboard_cache.invalidate()
+        board_bus.poke()
+    return applied
 
 @app.route("/contact/<int:cid>/move", methods=["POST"])
 @login_required
 def contact_move(cid):
-    data=request.get_json(silent=True) or {}; new_stage=data.get("stage","")
-    cfg = load_settings(get_db())
+    data=request.get_json(silent=True) or {}
+    new_stage=data.get("stage","") if isinstance(data, dict) else None
+    conn=get_db()
+    cfg = load_settings(conn)
     if new_stage not in cfg["contact_stages"]:
         return jsonify({"ok":False,"error":"stage inválido"}),400
+    return jsonify({"ok":True, "applied": apply_moves(conn, [(cid, new_stage)])})
+
+@app.route("/contacts/move", methods=["POST"])
+@login_required
+def contacts_move():
+    """Lote de movimentos do board: {"moves": [{"id": 1, "stage": "..."}, ...]}."""
+    data=request.get_json(silent=True) or {}
+    moves=data.get("moves") if isinstance(data, dict) else None
+    if not isinstance(moves, list) or not moves:
+        return jsonify({"ok":False,"error":"moves vazio"}),400
+    if len(moves) > MOVE_MAX_BATCH:
+        return jsonify({"ok":False,"error":f"máximo de {MOVE_MAX_BATCH} movimentos"}),400
     conn=get_db()
-    with conn:
-        conn.execute("UPDATE contacts SET contact_stage=?, updated_at=CURRENT_TIMESTAMP WHERE id=?",(new_stage,cid))
-        company = conn.execute("SELECT company_id FROM contacts WHERE id=?", (cid,)).fetchone()
-        log_event(conn, 'contact_stage_drag', company["company_id"] if company else None, cid, f"Estágio → <b>{new_stage}</b>")
-    return jsonify({"ok":True})
+    stages = set(load_settings(conn)["contact_stages"])
+    latest = {}  # o mesmo card movido várias vezes: vale o último destino
+    for m in moves:
+        try:
+            cid, stage = int(m["id"]), m["stage"]
+            if not isinstance(m, dict) or not isinstance(stage, str): raise TypeError
+        except (KeyError, TypeError, ValueError):
+            return jsonify({"ok":False,"error":"movimento inválido"}),400
+        if stage not in stages:
+            return jsonify({"ok":False,"error":f"stage inválido: {stage}"}),400
+        latest.pop(cid, None); latest[cid] = stage
+    applied = apply_moves(conn, list(latest.items()))
+    return jsonify({"ok":True, "received": len(moves), "applied": applied})
 
-# -------------------- Export simples --------------------
-@app.route('/export/companies.xlsx')
+# -------------------- Diagnóstico --------------------
+@app.route("/admin/db/pool")
+@role_required("admin")
+def db_pool_stats():
+    return jsonify(get_pool().snapshot())
+
+@app.route("/admin/activity/stats")
+@role_required("admin")
+def activity_stats():
+    st = dict(log_stats)
+    if log_writer is not None:
+        st["async"] = dict(log_writer.stats, pending=log_writer.queue.qsize())
+    return jsonify(st)
+
+@app.route("/admin/activity/compact", methods=["POST"])
+@role_required("admin")
+def activity_compact():
+    conn = get_db()
+    return jsonify({"ok": True, **compact_activity_log(conn, load_settings(conn)["activity_retention_days"])})
+
+@app.cli.command("compact-activity")
+@click.option("--days", type=int, default=None, help="Sobrescreve activity_retention_days.")
+def compact_activity_cmd(days):
+    """Arquiva eventos antigos do activity_log e gera os resumos diários."""
+    conn = get_db()
+    days = days or load_settings(conn)["activity_retention_days"]
+    click.echo(json.dumps(compact_activity_log(conn, days), ensure_ascii=False))
+
+@app.cli.command("check-query-plans")
+def check_query_plans_cmd():
+    """Falha (exit 1) se alguma consulta dos dashboards cair em full table scan."""
+    bad = dashboard_stats.full_scans(get_db())
+    for name, steps in bad.items():
+        click.echo(f"FULL SCAN em {name}: " + " | ".join(steps), err=True)
+    if bad:
+        raise SystemExit(1)
+    click.echo(f"ok: {len(dashboard_stats.DASHBOARD_QUERIES)} consultas sem SCAN fora de SCAN_ALLOWED")
+
+@app.route("/admin/auth/stats")
+@role_required("admin")
+def auth_stats():
+    return jsonify({"user_cache": user_cache.snapshot()})
+
+@app.cli.command("create-token")
+@click.argument("email")
+def create_token_cmd(email):
+    """Gera um token de API (Authorization: Bearer) para o usuário."""
+    conn = get_db()
+    row = conn.execute("SELECT id FROM users WHERE LOWER(email)=?", (email.strip().lower(),)).fetchone()
+    if not row:
+        raise click.ClickException(f"usuário não encontrado: {email}")
+    click.echo(issue_api_token(conn, row["id"]))
+
+@app.route("/metrics")
+@role_required("admin")
+def metrics():
+    """Formato texto do Prometheus (scrape com Authorization: Bearer)."""
+    lines = profiler.prometheus_lines() if PROFILE else []
+    pool = get_pool().snapshot()
+    for key, kind in (("acquired", "counter"), ("hits", "counter"), ("opened", "counter"),
+                      ("waits", "counter"), ("timeouts", "counter"), ("idle", "gauge"), ("size", "gauge")):
+        lines += profiling.gauge_lines(f"crm_db_pool_{key}" + ("_total" if kind == "counter" else ""),
+                                       f"Pool de conexões: {key}.", pool[key], kind)
+    lines += profiling.gauge_lines("crm_db_pool_wait_seconds_total", "Tempo esperando conexão.", pool["wait_ms"] / 1000, "counter")
+    uc = user_cache.snapshot()
+    lines += profiling.gauge_lines("crm_user_cache_hits_total", "Hits do cache de usuários.", uc["hits"], "counter")
+    lines += profiling.gauge_lines("crm_user_cache_misses_total", "Misses do cache de usuários.", uc["misses"], "counter")
+    lines += profiling.gauge_lines("crm_dashboard_cache_hits_total", "Hits do cache dos dashboards.", dashboard_cache.hits, "counter")
+    lines += profiling.gauge_lines("crm_dashboard_cache_misses_total", "Misses do cache dos dashboards.", dashboard_cache.misses, "counter")
+    lines += profiling.gauge_lines("crm_activity_log_failed_total", "Eventos de log_event perdidos (síncronos e lotes assíncronos).", log_stats["failed"], "counter")
+    lines += profiling.gauge_lines("crm_board_streams_open", "Streams SSE do board abertos.", board_bus.stats["streams_open"])
+    lines += profiling.gauge_lines("crm_board_events_published_total", "Eventos do board publicados.", board_bus.stats["published"], "counter")
+    return Response("\n".join(lines) + "\n", mimetype="text/plain; version=0.0.4")
+
+@app.route("/admin/profile/slow")
+@role_required("admin")
+def profile_slow():
+    return jsonify({"enabled": PROFILE, "slowest": profiler.slowest_statements()})
+
+# -------------------- Timeline --------------------
+TIMELINE_PAGE = 50
+
+@app.route("/company/<int:cid>/timeline")
 @login_required
-def export_companies_xlsx():
-    q = request.args.get('q',''); sort=request.args.get('sort','c.name'); direction=request.args.get('dir','asc')
+def company_timeline(cid):
+    """Eventos da empresa, mais recentes primeiro (keyset em ts,id). Na última
+    página vêm também os resumos diários dos eventos já arquivados."""
+    try:
+        limit = max(1, min(int(request.args.get("limit", TIMELINE_PAGE)), 200))
+        after = json.loads(request.args.get("after", "null"))
+        if after is not None:
+            ts, eid = after  # cursor = [ts, id]
+            after = [str(ts), int(eid)]
+    except (ValueError, TypeError):
+        return jsonify({"ok":False,"error":"cursor inválido"}),400
+    sql = "SELECT id, ts, type, contact_id, details FROM activity_log WHERE company_id=?"
+    params = [cid]
+    if after:
+        sql += " AND (ts, id) < (?, ?)"; params += after
+    conn = get_db()
+    rows = conn.execute(sql + " ORDER BY ts DESC, id DESC LIMIT ?", (*params, limit + 1)).fetchall()
+    events = [dict(r) for r in rows[:limit]]
+    out = {"ok": True, "events": events, "next": None}
+    if len(rows) > limit:
+        out["next"] = json.dumps([events[-1]["ts"], events[-1]["id"]])
+    else:
+        out["daily"] = [dict(r) for r in conn.execute(
+            "SELECT day, type, n FROM activity_daily WHERE company_id=? ORDER BY day DESC, type", (cid,))]
+    return jsonify(out)
+
+# -------------------- Export simples --------------------
+EXPORT_SORT_COLUMNS = ["c.name", "c.category", "c.subcategory", "c.city", "c.state",
+                       "c.reg_status_base", "c.created_at", "c.updated_at", "v.reg_status_effective"]
+EXPORT_CHUNK = 2000
+
+def _export_companies_query():
+    q = fts_query(request.args.get('q',''))
     sql = """SELECT c.*, v.reg_status_effective
-             FROM companies c LEFT JOIN company_status_view v ON v.id=c.id"""
+             FROM companies c LEFT JOIN company_status v ON v.company_id=c.id"""
     params=[]; where=[]
     if q:
-        like=f"%{q}%"; where.append("(c.name LIKE ? OR c.category LIKE ? OR c.subcategory LIKE ? OR c.city LIKE ?)"); params += [like,like,like,like]
+        where.append("c.id IN (SELECT rowid FROM companies_fts WHERE companies_fts MATCH ?)"); params.append(q)
     if where: sql += " WHERE "+ " AND ".join(where)
-    sql += f" ORDER BY {sort} {direction}"
-    conn=get_db(); rows=conn.execute(sql, params).fetchall(); conn.close()
-    df = pd.DataFrame([dict(r) for r in rows])
-    buf = BytesIO(); df.to_excel(buf, index=False); buf.seek(0)
-    return send_file(buf, as_attachment=True, download_name='companies.xlsx', mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
+    sql, _, _ = apply_sorting(sql, EXPORT_SORT_COLUMNS, "c.name")
+    return sql, params
+
+def _iter_export_rows(sql, params, conn=None):
+    """Primeiro a lista de colunas, depois lotes de linhas (tuplas).
+    Sem `conn`, pega uma conexão própria do pool: o gerador pode sobreviver ao
+    request (streaming), que então deve soltar a sua antes (release_db)."""
+    pool = None
+    if conn is None:
+        pool = get_pool(); conn = pool.acquire()
+    try:
+        cur = conn.execute(sql, params)
+        yield [d[0] for d in cur.description]
+        while True:
+            rows = cur.fetchmany(EXPORT_CHUNK)
+            if not rows: break
+            yield [tuple(r) for r in rows]
+    finally:
+        if pool: pool.release(conn)
+
+@app.route('/export/companies.xlsx')
+@login_required
+def export_companies_xlsx():
+    import xlsxwriter
+    sql, params = _export_companies_query()
+    rows = _iter_export_rows(sql, params, get_db())  # termina dentro do request
+    # xlsx precisa do zip fechado antes de enviar: gera num arquivo temporário
+    # com constant_memory (uma linha por vez em memória) e devolve o arquivo.
+    tmp = tempfile.TemporaryFile()
+    wb = xlsxwriter.Workbook(tmp, {"constant_memory": True, "strings_to_urls": False})
+    ws = wb.add_worksheet()
+    ws.write_row(0, 0, next(rows))
+    n = 1
+    for chunk in rows:
+        for r in chunk:
+            ws.write_row(n, 0, r); n += 1
+    wb.close(); tmp.seek(0)
+    return send_file(tmp, as_attachment=True, download_name='companies.xlsx', mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
+
+@app.route('/export/companies.csv')
+@login_required
+def export_companies_csv():
+    sql, params = _export_companies_query()
+    def generate():
+        rows = _iter_export_rows(sql, params)
+        buf = io.StringIO(); w = csv.writer(buf)
+        w.writerow(next(rows))
+        yield "\ufeff" + buf.getvalue()  # BOM: Excel abre acentos corretamente
+        for chunk in rows:
+            buf.seek(0); buf.truncate()
+            w.writerows(chunk)
+            yield buf.getvalue()
+    release_db(None)  # o gerador pega a dele; não segurar duas por request
+    return Response(generate(), mimetype='text/csv; charset=utf-8',
+                    headers={"Content-Disposition": "attachment; filename=companies.csv"})
+
+@app.route('/export/companies.ndjson')
+@login_required
+def export_companies_ndjson():
+    sql, params = _export_companies_query()
+    def generate():
+        rows = _iter_export_rows(sql, params)
+        cols = next(rows)
+        for chunk in rows:
+            yield "".join(json.dumps(dict(zip(cols, r)), ensure_ascii=False) + "\n" for r in chunk)
+    release_db(None)
+    return Response(generate(), mimetype='application/x-ndjson',
+                    headers={"Content-Disposition": "attachment; filename=companies.ndjson"})
+
+# -------------------- Forecast --------------------
+forecast_cache = dashboard_stats.StatsCache(ttl=float(os.environ.get("CRM_FORECAST_TTL", "3600")))
+
+def forecast_data(conn):
+    """Forecast do pipeline, recalculado só quando opportunities muda."""
+    import forecast  # numpy/pandas só quando alguém abre o forecast
+    return forecast_cache.get("forecast", data_revision(conn, "opportunities"),
+                              lambda: forecast.forecast(conn, OPP_STAGES))
+
+@app.route("/forecast")
+@login_required
+@conditional("opportunities")
+def forecast_view():
+    return render_template("forecast.html", fc=forecast_data(get_db()))
+
+@app.route("/api/forecast")
+@login_required
+@conditional("opportunities")
+def forecast_api():
+    return jsonify(forecast_data(get_db()))
+
+# -------------------- Funil / velocidade por estágio --------------------
+STAGE_REPORT_DAYS = 90
+
+@app.route("/api/stages/report")
+@login_required
+@conditional("contacts", "settings", daily=True)
+def stage_report():
+    """Funil e tempo médio por estágio num período (?start=&end=, ISO; padrão
+    últimos STAGE_REPORT_DAYS dias). Lê só os agregados diários, atualizados
+    aqui para os dias com histórico novo."""
+    today = datetime.date.today()
+    try:
+        end = datetime.date.fromisoformat(request.args.get("end") or today.isoformat())
+        start = datetime.date.fromisoformat(request.args.get("start") or (end - datetime.timedelta(days=STAGE_REPORT_DAYS)).isoformat())
+    except ValueError:
+        return jsonify({"ok":False,"error":"data inválida"}),400
+    conn = get_db()
+    cfg = load_settings(conn)
+    stages = cfg["contact_stages"]
+    refreshed = stage_history.refresh_rollups(conn)
+    period = (start.isoformat(), end.isoformat())
+    return jsonify({"ok":True, "start": period[0], "end": period[1], "refreshed": refreshed,
+                    "funnel": stage_history.funnel(conn, stages, *period, cfg["inactive_stages"]),
+                    "velocity": stage_history.velocity(conn, stages, *period)})
+
+@app.cli.command("refresh-stage-rollups")
+def refresh_stage_rollups_cmd():
+    """Atualiza stage_daily/stage_transition_daily com o histórico novo."""
+    conn = get_db()
+    click.echo(json.dumps(stage_history.refresh_rollups(conn)))
+
+# -------------------- Busca --------------------
+SEARCH_PAGE = 20
+SEARCH_MAX_PAGE = 100
+
+def fts_query(text):
+    """Texto livre -> consulta FTS5: cada termo normalizado vira prefixo ("sao"* "paul"*)."""
+    terms = [t for t in "".join(ch if ch.isalnum() else " " for ch in _norm(text)).split() if t]
+    return " ".join(f'"{t}"*' for t in terms)
+
+@app.route("/search")
+@login_required
+@conditional("companies", "contacts")
+def search():
+    match = fts_query(request.args.get("q", ""))
+    try:
+        limit = max(1, min(int(request.args.get("limit", SEARCH_PAGE)), SEARCH_MAX_PAGE))
+    except ValueError:
+        limit = SEARCH_PAGE
+    if not match:
+        return jsonify({"results": [], "next": None})
+    params = {"q": match, "n": limit + 1}
+    after = ""
+    cursor = request.args.get("after")
+    if cursor:
+        try:
+            score, kind, rid = json.loads(cursor)
+            params.update(s=float(score), k=str(kind), i=int(rid))
+            after = "WHERE (score, kind, id) > (:s, :k, :i)"
+        except (ValueError, TypeError):
+            return jsonify({"error": "cursor inválido"}), 400
+    # bm25: menor = mais relevante; peso maior para o nome
+    rows = get_db().execute(f"""
+        SELECT * FROM (
+          SELECT 'company' AS kind, co.id, co.name AS title,
+                 TRIM(IFNULL(co.category,'') || ' · ' || IFNULL(co.city,''), ' ·') AS subtitle,
+                 co.id AS company_id, bm25(companies_fts, 10.0, 2.0, 2.0, 3.0, 1.0) AS score
+          FROM companies_fts JOIN companies co ON co.id = companies_fts.rowid
+          WHERE companies_fts MATCH :q
+          UNION ALL
+          SELECT 'contact', ct.id, ct.name, co.name, ct.company_id,
+                 bm25(contacts_fts, 10.0, 2.0, 4.0, 1.0)
+          FROM contacts_fts JOIN contacts ct ON ct.id = contacts_fts.rowid
+          JOIN companies co ON co.id = ct.company_id
+          WHERE contacts_fts MATCH :q
+        ) {after}
+        ORDER BY score, kind, id LIMIT :n""", params).fetchall()
+    results = [dict(r) for r in rows[:limit]]
+    nxt = None
+    if len(rows) > limit:
+        last = results[-1]
+        nxt = json.dumps([last["score"], last["kind"], last["id"]])
+    return jsonify({"results": results, "next": nxt})
+
+# -------------------- Import em lote --------------------
+IMPORT_BATCH = 5000
+IMPORT_MAX_ERRORS = 500
+IMPORT_HEADER_ALIASES = {
+    "name": "name", "empresa": "name", "company": "name", "nome da empresa": "name",
+    "category": "category", "categoria": "category",
+    "subcategory": "subcategory", "subcategoria": "subcategory",
+    "reg_status_base": "reg_status_base", "status": "reg_status_base", "status base": "reg_status_base",
+    "city": "city", "cidade": "city",
+    "state": "state", "estado": "state", "uf": "state",
+    "notes": "notes", "notas": "notes", "observacoes": "notes",
+    "contact_name": "contact_name", "contato": "contact_name", "nome do contato": "contact_name",
+    "role": "role", "cargo": "role",
+    "email": "email", "e-mail": "email",
+    "phone": "phone", "telefone": "phone",
+    "contact_stage": "contact_stage", "estagio": "contact_stage",
+}
+COMPANY_UPSERT_SQL = """
+INSERT INTO companies (name, category, subcategory, reg_status_base, city, state, notes)
+VALUES (:name, IFNULL(:category,''), IFNULL(:subcategory,''), IFNULL(:reg_status_base,'Listado'),
+        IFNULL(:city,''), IFNULL(:state,''), IFNULL(:notes,''))
+ON CONFLICT(name) DO UPDATE SET
+  category=IFNULL(:category, category), subcategory=IFNULL(:subcategory, subcategory),
+  reg_status_base=IFNULL(:reg_status_base, reg_status_base), city=IFNULL(:city, city),
+  state=IFNULL(:state, state), notes=IFNULL(:notes, notes), updated_at=CURRENT_TIMESTAMP"""
+
+def _import_records(header, rows, first_line=2):
+    """Converte linhas cruas em (linha, dict) com as chaves de IMPORT_HEADER_ALIASES."""
+    fields = [IMPORT_HEADER_ALIASES.get(_norm(h)) for h in header]
+    for n, row in enumerate(rows, first_line):
+        rec = {}
+        for field, val in zip(fields, row):
+            if field is None: continue
+            val = str(val).strip() if val is not None else ""
+            rec[field] = val or None
+        if any(v is not None for v in rec.values()):
+            yield n, rec
+
+IMPORT_SNIFF_BYTES = 64 * 1024
+# erros de leitura/parse do arquivo (não dos dados): viram ValueError com a linha
+IMPORT_READ_ERRORS = (UnicodeDecodeError, csv.Error, zipfile.BadZipFile, zlib.error, EOFError, KeyError, OSError)
+
+def _csv_encoding(fileobj):
+    """utf-8 se o início do arquivo decodifica, senão cp1252 (CSV do Excel em pt-BR)."""
+    head = fileobj.read(IMPORT_SNIFF_BYTES); fileobj.seek(0)
+    try:
+        codecs.getincrementaldecoder("utf-8")().decode(head, final=len(head) < IMPORT_SNIFF_BYTES)
+        return "utf-8-sig"
+    except UnicodeDecodeError:
+        return "cp1252"
+
+def read_import_file(fileobj, filename):
+    """Itera (linha, registro) de um CSV ou XLSX sem carregar o arquivo inteiro.
+    Arquivo corrompido ou com bytes inválidos levanta ValueError("linha N: ...")
+    no ponto em que a leitura falhou; as linhas anteriores já foram entregues."""
+    if filename.lower().endswith((".xlsx", ".xlsm")):
+        import openpyxl
+        line = 1
+        try:
+            wb = openpyxl.load_workbook(fileobj, read_only=True, data_only=True)
+        except IMPORT_READ_ERRORS as e:
+            raise ValueError(f"xlsx inválido: {e}") from e
+        try:
+            rows = wb.active.iter_rows(values_only=True)
+            for line, rec in _import_records(next(rows, ()), rows):
+                yield line, rec
+        except IMPORT_READ_ERRORS as e:
+            raise ValueError(f"linha {line + 1}: xlsx ilegível: {e}") from e
+        finally:
+            wb.close()
+        return
+    encoding = _csv_encoding(fileobj)
+    sample = fileobj.read(4096).decode(encoding, "ignore"); fileobj.seek(0)
+    # decodifica linha a linha: um byte inválido aponta a linha exata
+    text = (raw.decode(encoding) for raw in fileobj)
+    rows = None
+    try:
+        try:
+            dialect = csv.Sniffer().sniff(sample, delimiters=",;\t")
+        except csv.Error:
+            dialect = csv.excel
+        rows = csv.reader(text, dialect)
+        yield from _import_records(next(rows, []), rows)
+    except IMPORT_READ_ERRORS as e:
+        raise ValueError(f"linha {(rows.line_num if rows else 0) + 1}: {e}") from e
+
+def import_companies(conn, records, batch_size=IMPORT_BATCH):
+    """Grava empresas (UPSERT por nome) e contatos em transações de `batch_size` linhas.
+    Nomes são deduplicados por _norm() contra a base e dentro do próprio arquivo."""
+    stages = set(load_settings(conn)["contact_stages"])
+    companies = {_norm(r["name"]): r["name"] for r in conn.execute("SELECT name FROM companies")}
+    contacts = {(r["company_id"], _norm(r["name"])): r["id"]
+                for r in conn.execute("SELECT id, company_id, name FROM contacts")}
+    report = {"rows": 0, "batches": 0, "companies_new": 0, "companies_updated": 0,
+              "contacts_new": 0, "contacts_updated": 0, "errors": [], "error_count": 0}
+    t0 = time.perf_counter()
+
+    def error(line, msg):
+        report["error_count"] += 1
+        if len(report["errors"]) < IMPORT_MAX_ERRORS:
+            report["errors"].append({"line": line, "error": msg})
+
+    def flush(batch):
+        if not batch: return
+        comp_rows = {}
+        for line, rec in batch:
+            key = _norm(rec["name"])
+            canonical = companies.get(key) or comp_rows.get(key, {}).get("name") or rec["name"]
+            merged = comp_rows.setdefault(key, {f: None for f in ("category","subcategory","reg_status_base","city","state","notes")})
+            merged.update({k: v for k, v in rec.items() if k in merged and v is not None})
+            merged["name"] = canonical
+        new_keys = [k for k in comp_rows if k not in companies]
+        with conn:
+            conn.executemany(COMPANY_UPSERT_SQL, list(comp_rows.values()))
+            names = [r["name"] for r in comp_rows.values()]
+            ids = {}
+            for i in range(0, len(names), 500):
+                part = names[i:i+500]
+                for r in conn.execute(f"SELECT id, name FROM companies WHERE name IN ({','.join('?'*len(part))})", part):
+                    ids[_norm(r["name"])] = r["id"]
+            ins, upd = {}, []
+            for line, rec in batch:
+                if not rec.get("contact_name"): continue
+                cid = ids[_norm(rec["name"])]
+                key = (cid, _norm(rec["contact_name"]))
+                vals = [rec.get("role"), rec.get("email"), rec.get("phone"), rec.get("contact_stage")]
+                if key in contacts:
+                    upd.append(vals + [contacts[key]])
+                elif key in ins:  # repetido no mesmo lote: completa os campos vazios
+                    ins[key][2:] = [v if v is not None else old for v, old in zip(vals, ins[key][2:])]
+                else:
+                    ins[key] = [cid, rec["contact_name"]] + vals
+            ins = list(ins.values())
+            conn.executemany("""INSERT INTO contacts (company_id, name, role, email, phone, contact_stage)
+                                VALUES (?,?,IFNULL(?,''),IFNULL(?,''),IFNULL(?,''),IFNULL(?,'Contato Inicial'))""", ins)
+            conn.executemany("""UPDATE contacts SET role=IFNULL(?,role), email=IFNULL(?,email), phone=IFNULL(?,phone),
+                                contact_stage=IFNULL(?,contact_stage), updated_at=CURRENT_TIMESTAMP
+                                WHERE id=?""", upd)
+            if ins:
+                cids = sorted({i[0] for i in ins})
+                for i in range(0, len(cids), 500):
+                    part = cids[i:i+500]
+                    for r in conn.execute(f"SELECT id, company_id, name FROM contacts WHERE company_id IN ({','.join('?'*len(part))})", part):
+                        contacts[(r["company_id"], _norm(r["name"]))] = r["id"]
+            log_event(conn, 'import_batch', None, None,
+                      f"Importação: linhas {batch[0][0]}–{batch[-1][0]}, {len(new_keys)} empresas novas, "
+                      f"{len(ins)} contatos novos")
+        for k in new_keys: companies[k] = comp_rows[k]["name"]
+        report["batches"] += 1
+        report["companies_new"] += len(new_keys)
+        report["companies_updated"] += len(comp_rows) - len(new_keys)
+        report["contacts_new"] += len(ins)
+        report["contacts_updated"] += len(upd)
+
+    batch = []
+    records = iter(records)
+    while True:
+        try:
+            line, rec = next(records)
+        except StopIteration:
+            break
+        except ValueError as e:  # arquivo ilegível daqui em diante: grava o que já foi lido
+            report["aborted"] = str(e)
+            break
+        report["rows"] += 1
+        if not rec.get("name"):
+            error(line, "nome da empresa vazio"); continue
+        if rec.get("contact_stage") and rec["contact_stage"] not in stages:
+            error(line, f"estágio inválido: {rec['contact_stage']}"); continue
+        batch.append((line, rec))
+        if len(batch) >= batch_size:
+            flush(batch); batch = []
+    flush(batch)
+    elapsed = time.perf_counter() - t0
+    report["seconds"] = round(elapsed, 3)
+    report["rows_per_sec"] = round(report["rows"] / elapsed, 1) if elapsed else None
+    dashboard_cache.invalidate()
+    return report
+
+@app.route("/import", methods=["GET","POST"])
+@role_required("admin")
+def import_view():
+    if request.method == "GET":
+        return render_template("import.html")
+    f = request.files.get("file")
+    if not f or not f.filename:
+        return jsonify({"ok": False, "error": "arquivo ausente"}), 400
+    report = import_companies(get_db(), read_import_file(f.stream, f.filename))
+    if "aborted" in report:  # o relatório diz o que entrou antes do erro
+        return jsonify({"ok": False, "error": report["aborted"], **report}), 400
+    return jsonify({"ok": True, **report})
+
+@app.cli.command("import-companies")
+@click.argument("path", type=click.Path(exists=True, dir_okay=False))
+@click.option("--batch-size", default=IMPORT_BATCH, show_default=True)
+def import_companies_cmd(path, batch_size):
+    """Importa empresas/contatos de um CSV ou XLSX."""
+    with open(path, "rb") as fh:
+        report = import_companies(get_db(), read_import_file(fh, path), batch_size=batch_size)
+    click.echo(json.dumps(report, ensure_ascii=False, indent=2))
 
 # -------------------- Templates mínimos --------------------
 # (Deixe os templates da sua pasta /templates atuais; este app.py só garante que o servidor roda sem erros.)
 
 if __name__ == "__main__":
     init_db()
-    app.run(debug=True)
+    app.run(debug=os.environ.get("CRM_DEBUG", "0") == "1")
@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark das rotas principais via Flask test client.
+- p50/p95 de latência, SQL por request (Server-Timing) e pico de RSS
+- Cada rota roda num processo próprio: ru_maxrss só cresce, então no mesmo
+  processo o pico de uma rota seria o maior visto até ali
+- Custo de startup (import do app, init_db) medido num processo novo
+- Saída em JSON; --compare mostra a diferença contra um resultado anterior
+
+Uso:
+  python seed_data.py bench_100k.db --scale 100k
+  python bench.py --db bench_100k.db --repeat 30 --out antes.json
+  python bench.py --db bench_100k.db --repeat 30 --compare antes.json
+"""
+import argparse, datetime, json, os, platform, re, sqlite3, statistics, subprocess, sys, time
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+ROUTES = ["dashboard", "dashboard_companies", "board", "contact_move", "export_xlsx"]
+HEAVY_MODULES = ["pandas", "numpy", "openpyxl", "xlsxwriter", "forecast"]
+
+# roda num interpretador limpo: no processo do benchmark o app já está importado
+STARTUP_SNIPPET = """
+import json, sys, time
+t0 = time.perf_counter(); import app as crm; t1 = time.perf_counter()
+applied = crm.init_db(); t2 = time.perf_counter()
+crm.init_db(); t3 = time.perf_counter()
+print(json.dumps({"import_ms": round((t1 - t0) * 1000, 1), "init_db_ms": round((t2 - t1) * 1000, 1),
+                  "init_db_noop_ms": round((t3 - t2) * 1000, 1), "migrations_applied": applied,
+                  "heavy_modules_loaded": [m for m in %r if m in sys.modules]}))
+"""
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(rss / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+def percentile(values, p):
+    values = sorted(values)
+    k = (len(values) - 1) * p / 100
+    lo, hi = int(k), min(int(k) + 1, len(values) - 1)
+    return values[lo] + (values[hi] - values[lo]) * (k - lo)
+
+def _sql_count(resp):
+    m = re.search(r'desc="(\d+) queries"', resp.headers.get("Server-Timing", ""))
+    return int(m.group(1)) if m else None
+
+def startup(db):
+    env = dict(os.environ, CRM_DB=os.path.abspath(db))
+    here = os.path.dirname(os.path.abspath(__file__))
+    out = subprocess.run([sys.executable, "-c", STARTUP_SNIPPET % HEAVY_MODULES], cwd=here, env=env,
+                         capture_output=True, text=True, check=True).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+def run_route(db, route, repeat=30, warm_cache=False):
+    """Mede uma rota neste processo (chamado via --route-only num processo novo)."""
+    os.environ["CRM_DB"] = os.path.abspath(db)
+    os.environ["CRM_PROFILE"] = "1"
+    if not warm_cache:
+        os.environ["CRM_DASHBOARD_TTL"] = "0"
+    import app as crm
+    crm.init_db()
+    client = crm.app.test_client()
+    client.post("/login", data={"email": "admin@example.com", "password": "admin"})
+
+    conn = sqlite3.connect(os.environ["CRM_DB"])
+    contact_ids = [r[0] for r in conn.execute("SELECT id FROM contacts ORDER BY id LIMIT 200")]
+    conn.close()
+    stages = crm.DEFAULT_SETTINGS["contact_stages"]
+
+    def request(i):
+        if route == "contact_move":
+            cid = contact_ids[i % len(contact_ids)] if contact_ids else 0
+            return client.post(f"/contact/{cid}/move", json={"stage": stages[i % len(stages)]})
+        path = {"dashboard": "/dashboard", "dashboard_companies": "/dashboard_companies",
+                "board": "/board", "export_xlsx": "/export/companies.xlsx"}[route]
+        return client.get(path)
+
+    request(0).close()  # aquecimento (pool, caches do SQLite)
+    lat, sql = [], []
+    for i in range(repeat):
+        t0 = time.perf_counter()
+        resp = request(i + 1)
+        resp.get_data()  # consome respostas em streaming
+        lat.append((time.perf_counter() - t0) * 1000)
+        if resp.status_code >= 400:
+            raise RuntimeError(f"{route}: HTTP {resp.status_code}")
+        sql.append(_sql_count(resp))
+        resp.close()
+    return {"p50_ms": round(percentile(lat, 50), 2), "p95_ms": round(percentile(lat, 95), 2),
+            "mean_ms": round(statistics.fmean(lat), 2),
+            "sql_per_request": max((s for s in sql if s is not None), default=None),
+            "peak_rss_mb": peak_rss_mb()}
+
+def run(db, repeat=30, warm_cache=False, routes=ROUTES):
+    conn = sqlite3.connect(os.path.abspath(db))
+    counts = {t: conn.execute(f"SELECT COUNT(*) FROM {t}").fetchone()[0]
+              for t in ("companies", "contacts", "tasks", "opportunities")}
+    conn.close()
+    results = {}
+    for route in routes:
+        cmd = [sys.executable, os.path.abspath(__file__), "--db", db, "--repeat", str(repeat), "--route-only", route]
+        if warm_cache:
+            cmd.append("--warm-cache")
+        out = subprocess.run(cmd, capture_output=True, text=True, check=True).stdout
+        results[route] = json.loads(out.strip().splitlines()[-1])
+    return {"startup": startup(db),
+            "meta": {"db": os.path.basename(db), "rows": counts, "repeat": repeat, "warm_cache": warm_cache,
+                     "python": platform.python_version(), "sqlite": sqlite3.sqlite_version,
+                     "platform": platform.platform(), "at": datetime.datetime.now().isoformat(timespec="seconds")},
+            "routes": results}
+
+def compare(before, after):
+    lines = [f"{'rota':<22}{'p50 antes':>11}{'p50 depois':>12}{'Δ%':>8}{'p95 antes':>11}{'p95 depois':>12}{'SQL':>10}"]
+    for route, a in after["routes"].items():
+        b = before["routes"].get(route)
+        if not b:
+            continue
+        delta = 100 * (a["p50_ms"] - b["p50_ms"]) / b["p50_ms"] if b["p50_ms"] else 0
+        lines.append(f"{route:<22}{b['p50_ms']:>11}{a['p50_ms']:>12}{delta:>+8.1f}{b['p95_ms']:>11}{a['p95_ms']:>12}"
+                     f"{str(b['sql_per_request']) + '→' + str(a['sql_per_request']):>10}")
+    sb, sa = before.get("startup"), after.get("startup")
+    if sb and sa:
+        lines.append(f"{'startup import':<22}{sb['import_ms']:>11}{sa['import_ms']:>12}")
+        lines.append(f"{'startup init_db':<22}{sb['init_db_noop_ms']:>11}{sa['init_db_noop_ms']:>12}")
+    return "\n".join(lines)
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--db", required=True, help="base gerada com seed_data.py")
+    ap.add_argument("--repeat", type=int, default=30)
+    ap.add_argument("--routes", default=",".join(ROUTES))
+    ap.add_argument("--warm-cache", action="store_true", help="mantém o cache dos dashboards ligado")
+    ap.add_argument("--out", help="grava o JSON neste arquivo")
+    ap.add_argument("--compare", help="JSON de uma execução anterior")
+    ap.add_argument("--route-only", help=argparse.SUPPRESS)  # processo filho de run()
+    a = ap.parse_args(argv)
+    if a.route_only:
+        print(json.dumps(run_route(a.db, a.route_only, a.repeat, a.warm_cache)))
+        return
+    result = run(a.db, a.repeat, a.warm_cache, [r for r in a.routes.split(",") if r])
+    text = json.dumps(result, ensure_ascii=False, indent=2)
+    if a.out:
+        with open(a.out, "w", encoding="utf-8") as fh:
+            fh.write(text)
+    print(text)
+    if a.compare:
+        with open(a.compare, encoding="utf-8") as fh:
+            print(compare(json.load(fh), result), file=sys.stderr)
+
+if __name__ == "__main__":
+    sys.exit(main())
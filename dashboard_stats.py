@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+"""
+Agregações dos dashboards (/dashboard e /dashboard_companies).
+- Cada bloco de KPI é uma consulta só, com agregação condicional
+- Tempo de cada bloco fica em result["timings"] (ms)
+- StatsCache guarda o resultado por revisão dos dados (data_revisions), com TTL curto
+"""
+import datetime, threading, time
+from contextlib import contextmanager
+
+STAGE_INITIAL = "Contato Inicial"
+STAGES_RETORNO_POS = ("Reunião Marcada", "Projeto Ganho")
+STAGES_POTENCIAL_IMEDIATO = ("Marcar Reunião", "Reunião Marcada", "Acompanhar")
+TOP_SUBCATEGORIES = 20
+
+SQL_COMPANIES_BASE = "SELECT reg_status_base AS k, COUNT(*) c FROM companies GROUP BY reg_status_base"
+SQL_COMPANIES_EFFECTIVE = "SELECT status AS k, n AS c FROM company_status_totals"
+SQL_CONTACTS_STAGE = "SELECT contact_stage AS k, COUNT(*) c FROM contacts GROUP BY contact_stage"
+SQL_FUNNEL = f"""
+    SELECT COUNT(*) AS mapeados,
+           IFNULL(SUM(acionado),0) AS acionados,
+           IFNULL(SUM(retorno_pos),0) AS retorno_pos,
+           IFNULL(SUM(potencial),0) AS potencial_imediato
+    FROM (
+      SELECT ct.company_id,
+             MAX(ct.contact_stage <> ?) AS acionado,
+             MAX(ct.contact_stage IN ({",".join("?" * len(STAGES_RETORNO_POS))})) AS retorno_pos,
+             MAX(ct.contact_stage IN ({",".join("?" * len(STAGES_POTENCIAL_IMEDIATO))})) AS potencial
+      FROM contacts ct JOIN companies co ON co.id=ct.company_id
+      GROUP BY ct.company_id
+    )"""
+SQL_FUNNEL_PARAMS = (STAGE_INITIAL, *STAGES_RETORNO_POS, *STAGES_POTENCIAL_IMEDIATO)
+SQL_CATEGORIES = "SELECT category cat, subcategory sub, COUNT(*) c FROM companies GROUP BY category, subcategory"
+# tasks.due_date é sempre 'YYYY-MM-DD' ou NULL e done é 0/1 (ver init_db), então
+# as duas consultas são range scans no índice parcial idx_tasks_open_due.
+# "Hoje" vem como parâmetro (data local do servidor), a mesma que vira a ETag
+# e a chave de cache; date('now') do SQLite é UTC e viraria o dia em outra hora.
+SQL_TASKS_OVERDUE = """
+    SELECT t.*, co.name AS company_name, ct.name AS contact_name
+    FROM tasks t JOIN companies co ON co.id=t.company_id
+    LEFT JOIN contacts ct ON ct.id=t.contact_id
+    WHERE t.done=0 AND t.due_date < ?
+    ORDER BY t.due_date ASC LIMIT 30"""
+SQL_TASKS_NEXT7 = """
+    SELECT t.*, co.name AS company_name, ct.name AS contact_name
+    FROM tasks t JOIN companies co ON co.id=t.company_id
+    LEFT JOIN contacts ct ON ct.id=t.contact_id
+    WHERE t.done=0 AND t.due_date BETWEEN ? AND date(?, '+7 day')
+    ORDER BY t.due_date ASC LIMIT 30"""
+
+@contextmanager
+def _timed(timings, block):
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[block] = round((time.perf_counter() - t0) * 1000, 2)
+
+def general_stats(conn, today=None):
+    """KPIs do dashboard geral: status base/efetivo, contatos por estágio e tarefas.
+    `today` (datetime.date) define atrasadas/próximos 7 dias; padrão: data local."""
+    timings, out = {}, {}
+    today = (today or datetime.date.today()).isoformat()
+    with _timed(timings, "companies_base"):
+        rows = conn.execute(SQL_COMPANIES_BASE).fetchall()
+        out["base_map"] = {r["k"]: r["c"] for r in rows}
+        out["total_companies"] = sum(out["base_map"].values())
+    with _timed(timings, "companies_effective"):
+        rows = conn.execute(SQL_COMPANIES_EFFECTIVE).fetchall()
+        out["eff_map"] = {r["k"]: r["c"] for r in rows}
+    with _timed(timings, "contacts_stage"):
+        rows = conn.execute(SQL_CONTACTS_STAGE).fetchall()
+        out["stage_map"] = {r["k"]: r["c"] for r in rows}
+        out["total_contacts"] = sum(out["stage_map"].values())
+    with _timed(timings, "tasks_overdue"):
+        out["overdue"] = [dict(r) for r in conn.execute(SQL_TASKS_OVERDUE, (today,))]
+    with _timed(timings, "tasks_next7"):
+        out["next7"] = [dict(r) for r in conn.execute(SQL_TASKS_NEXT7, (today, today))]
+    out["timings"] = timings
+    return out
+
+def company_stats(conn):
+    """KPIs do dashboard de empresas em duas varreduras: contatos (funil) e empresas (categorias)."""
+    timings, out = {}, {}
+    with _timed(timings, "funnel"):
+        # uma linha por empresa com contato; MAX(cond) = "algum contato satisfaz"
+        row = conn.execute(SQL_FUNNEL, SQL_FUNNEL_PARAMS).fetchone()
+        out.update({k: int(row[k]) for k in ("mapeados", "acionados", "retorno_pos", "potencial_imediato")})
+    with _timed(timings, "categories"):
+        cats, subs, total = {}, {}, 0
+        for r in conn.execute(SQL_CATEGORIES):
+            cat, sub = r["cat"] or "", r["sub"] or ""
+            cats[cat] = cats.get(cat, 0) + r["c"]
+            subs[sub] = subs.get(sub, 0) + r["c"]
+            total += r["c"]
+        out["total"] = total
+        out["by_cat"] = sorted(cats.items(), key=lambda kv: (-kv[1], kv[0]))
+        out["by_sub"] = sorted(subs.items(), key=lambda kv: (-kv[1], kv[0]))[:TOP_SUBCATEGORIES]
+    out["timings"] = timings
+    return out
+
+# Todas as consultas dos dashboards, para a checagem de plano (flask check-query-plans)
+DASHBOARD_QUERIES = {
+    "companies_base": (SQL_COMPANIES_BASE, ()),
+    "companies_effective": (SQL_COMPANIES_EFFECTIVE, ()),
+    "contacts_stage": (SQL_CONTACTS_STAGE, ()),
+    "tasks_overdue": (SQL_TASKS_OVERDUE, ("2000-01-01",)),
+    "tasks_next7": (SQL_TASKS_NEXT7, ("2000-01-01", "2000-01-01")),
+    "funnel": (SQL_FUNNEL, SQL_FUNNEL_PARAMS),
+    "categories": (SQL_CATEGORIES, ()),
+}
+# Passos SCAN aceitos, por consulta. Tudo que não estiver aqui é regressão,
+# inclusive "SCAN t USING INDEX" (varre o índice inteiro e ainda busca cada linha).
+SCAN_ALLOWED = {
+    # GROUP BY sobre a tabela toda; o índice cobre a coluna agrupada
+    "companies_base": {"SCAN companies USING COVERING INDEX idx_companies_base"},
+    "contacts_stage": {"SCAN contacts USING COVERING INDEX idx_contacts_stage"},
+    "categories": {"SCAN companies USING COVERING INDEX idx_companies_cat"},
+    # uma linha por status, pequena por construção
+    "companies_effective": {"SCAN company_status_totals"},
+    # funil lê todos os contatos agrupados por empresa, só pelo índice
+    "funnel": {"SCAN ct USING COVERING INDEX idx_contacts_company_stage", "SCAN (subquery-1)"},
+}
+
+def full_scans(conn, queries=None):
+    """EXPLAIN QUERY PLAN de cada consulta; devolve {nome: [passos]} das que têm
+    algum passo SCAN fora de SCAN_ALLOWED[nome]."""
+    bad = {}
+    for name, (sql, params) in (queries or DASHBOARD_QUERIES).items():
+        steps = [r[3] for r in conn.execute("EXPLAIN QUERY PLAN " + sql, params)]
+        allowed = SCAN_ALLOWED.get(name, set())
+        if any(st.startswith("SCAN ") and st not in allowed for st in steps):
+            bad[name] = steps
+    return bad
+
+class StatsCache:
+    """Resultados por (nome, revisão). Expiram em `ttl` segundos
+    ou quando invalidate() é chamado por uma rota de escrita."""
+    def __init__(self, ttl=5.0):
+        self.ttl = ttl
+        self._data = {}
+        self._lock = threading.Lock()
+        self.hits = self.misses = 0
+
+    def get(self, name, rev, compute):
+        key = (name, rev)
+        now = time.monotonic()
+        with self._lock:
+            hit = self._data.get(key)
+            if hit and now - hit[0] < self.ttl:
+                self.hits += 1
+                return hit[1]
+            self.misses += 1
+        value = compute()
+        with self._lock:
+            self._data = {k: v for k, v in self._data.items() if k[0] != name}
+            self._data[key] = (now, value)
+        return value
+
+    def invalidate(self):
+        with self._lock:
+            self._data.clear()
@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+"""
+Forecast do pipeline de oportunidades.
+- Lê opportunities numa consulta só, em lotes, direto para arrays NumPy
+- Pipeline ponderado (amount × probability), conversão entre estágios e
+  buckets mensais de fechamento por dono, tudo vetorizado com pandas
+"""
+import numpy as np
+import pandas as pd
+
+CHUNK = 50_000
+NO_OWNER = "(sem dono)"
+NO_DATE = "(sem data)"
+WON, LOST = "Fechado - Ganho", "Fechado - Perdido"
+
+def load_opportunities(conn, chunk=CHUNK):
+    """DataFrame com stage, amount, probability (0–1), close_month e owner."""
+    cur = conn.execute("""SELECT stage, IFNULL(amount,0), IFNULL(probability,0),
+                                 substr(close_date,1,7), IFNULL(NULLIF(TRIM(owner),''), ?)
+                          FROM opportunities""", (NO_OWNER,))
+    parts = []
+    while True:
+        rows = cur.fetchmany(chunk)
+        if not rows: break
+        parts.append(np.array(rows, dtype=object))
+    cols = ["stage", "amount", "probability", "close_month", "owner"]
+    if not parts:
+        return pd.DataFrame({c: pd.Series(dtype="float64" if c in ("amount", "probability") else "object") for c in cols})
+    data = np.concatenate(parts)
+    df = pd.DataFrame(data, columns=cols)
+    df["amount"] = pd.to_numeric(df["amount"], errors="coerce").fillna(0.0).astype("float64")
+    df["probability"] = (pd.to_numeric(df["probability"], errors="coerce").fillna(0.0).clip(0, 100) / 100).astype("float64")
+    df["close_month"] = df["close_month"].where(df["close_month"].str.match(r"^\d{4}-\d{2}$", na=False), NO_DATE)
+    return df
+
+def compute(df, stages):
+    """Agregados do forecast. `stages` é a ordem do funil (OPP_STAGES)."""
+    df = df.assign(weighted=df["amount"] * df["probability"])
+    is_open = ~df["stage"].isin([WON, LOST])
+    open_df = df[is_open]
+
+    by_stage = (df.groupby("stage")
+                  .agg(count=("amount", "size"), amount=("amount", "sum"), weighted=("weighted", "sum"))
+                  .reindex(stages, fill_value=0))
+
+    # Conversão: com o estado atual só dá para saber até onde cada oportunidade
+    # chegou. Ganhas passaram por todos os estágios abertos; perdidas contam só
+    # no primeiro (não há histórico de onde caíram).
+    open_stages = [s for s in stages if s not in (WON, LOST)]
+    order = {s: i for i, s in enumerate(open_stages)}
+    order[WON] = len(open_stages)
+    pos = df["stage"].map(order)
+    reached = np.array([(pos >= i).sum() + (df["stage"] == LOST).sum() * (i == 0)
+                        for i in range(len(open_stages) + 1)], dtype="float64")
+    with np.errstate(divide="ignore", invalid="ignore"):
+        rates = np.where(reached[:-1] > 0, reached[1:] / reached[:-1], 0.0)
+    conversion = [{"from": open_stages[i], "to": (open_stages + [WON])[i + 1],
+                   "reached": int(reached[i]), "rate": round(float(rates[i]), 4)}
+                  for i in range(len(open_stages))]
+    won, lost = int((df["stage"] == WON).sum()), int((df["stage"] == LOST).sum())
+
+    monthly = (open_df.pivot_table(index="owner", columns="close_month", values="weighted",
+                                   aggfunc="sum", fill_value=0.0)
+               if len(open_df) else pd.DataFrame())
+    monthly = monthly.reindex(sorted(monthly.columns, key=lambda m: (m == NO_DATE, m)), axis=1)
+    by_owner = open_df.groupby("owner").agg(count=("amount", "size"), amount=("amount", "sum"),
+                                            weighted=("weighted", "sum")).sort_values("weighted", ascending=False)
+    return {
+        "totals": {"count": int(len(df)), "open_count": int(is_open.sum()),
+                   "open_amount": round(float(open_df["amount"].sum()), 2),
+                   "weighted_pipeline": round(float(open_df["weighted"].sum()), 2),
+                   "won_amount": round(float(df.loc[df["stage"] == WON, "amount"].sum()), 2),
+                   "win_rate": round(won / (won + lost), 4) if won + lost else None},
+        "by_stage": [{"stage": s, "count": int(r["count"]), "amount": round(float(r["amount"]), 2),
+                      "weighted": round(float(r["weighted"]), 2)} for s, r in by_stage.iterrows()],
+        "conversion": conversion,
+        "by_owner": [{"owner": o, "count": int(r["count"]), "amount": round(float(r["amount"]), 2),
+                      "weighted": round(float(r["weighted"]), 2)} for o, r in by_owner.iterrows()],
+        "monthly": {"months": [str(m) for m in monthly.columns],
+                    "owners": {str(o): [round(float(v), 2) for v in row] for o, row in monthly.iterrows()}},
+    }
+
+def forecast(conn, stages):
+    return compute(load_opportunities(conn), stages)
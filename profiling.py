@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+"""
+Profiling opcional por request (CRM_PROFILE=1).
+- Histograma de latência por rota
+- Contagem/tempo de SQL por request via TracedConnection (factory do sqlite3)
+- Top N statements mais lentos e aviso de N+1 (mesmo SQL repetido no request)
+- Header Server-Timing e texto no formato Prometheus para /metrics
+"""
+import heapq, sqlite3, threading, time
+from collections import Counter
+from flask import g, request, has_request_context
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SLOW_TOP = 20
+N_PLUS_ONE_THRESHOLD = 5
+
+class TracedConnection(sqlite3.Connection):
+    """Cronometra execute/executemany/executescript e registra no request atual."""
+    def _traced(self, fn, sql, *args):
+        t0 = time.perf_counter()
+        try:
+            return fn(sql, *args)
+        finally:
+            if has_request_context() and "sql_trace" in g:
+                g.sql_trace.append((sql, time.perf_counter() - t0))
+
+    def execute(self, sql, *args):
+        return self._traced(super().execute, sql, *args)
+
+    def executemany(self, sql, *args):
+        return self._traced(super().executemany, sql, *args)
+
+    def executescript(self, sql):
+        return self._traced(super().executescript, sql)
+
+def _normalize(sql):
+    return " ".join(sql.split())
+
+class Profiler:
+    def __init__(self, buckets=LATENCY_BUCKETS, slow_top=SLOW_TOP, n_plus_one=N_PLUS_ONE_THRESHOLD):
+        self.buckets = buckets
+        self.slow_top = slow_top
+        self.n_plus_one = n_plus_one
+        self._lock = threading.Lock()
+        self.routes = {}   # rota -> {"buckets": [...], "sum": s, "count": n, "sql": n, "sql_seconds": s, "n_plus_one": n}
+        self.slowest = []  # heap (segundos, sql, rota)
+        self.logger = None
+
+    def init_app(self, app):
+        self.logger = app.logger
+        app.before_request(self._before)
+        app.after_request(self._after)
+
+    def _before(self):
+        g.prof_t0 = time.perf_counter()
+        g.sql_trace = []
+
+    def _after(self, response):
+        if "prof_t0" not in g:
+            return response
+        elapsed = time.perf_counter() - g.prof_t0
+        trace = g.sql_trace
+        route = request.url_rule.rule if request.url_rule else "(404)"
+        sql_seconds = sum(d for _, d in trace)
+        repeated = [(sql, n) for sql, n in Counter(_normalize(s) for s, _ in trace).items()
+                    if n >= self.n_plus_one]
+        for sql, n in repeated:
+            self.logger.warning("possível N+1 em %s: %d× %s", route, n, sql[:200])
+        with self._lock:
+            st = self.routes.setdefault(route, {"buckets": [0] * len(self.buckets), "sum": 0.0, "count": 0,
+                                                "sql": 0, "sql_seconds": 0.0, "n_plus_one": 0})
+            for i, le in enumerate(self.buckets):
+                if elapsed <= le:
+                    st["buckets"][i] += 1
+            st["sum"] += elapsed; st["count"] += 1
+            st["sql"] += len(trace); st["sql_seconds"] += sql_seconds
+            st["n_plus_one"] += len(repeated)
+            for sql, d in trace:
+                item = (d, _normalize(sql)[:500], route)
+                if len(self.slowest) < self.slow_top:
+                    heapq.heappush(self.slowest, item)
+                elif d > self.slowest[0][0]:
+                    heapq.heapreplace(self.slowest, item)
+        response.headers.add("Server-Timing",
+                             f'app;dur={elapsed * 1000:.1f}, sql;dur={sql_seconds * 1000:.1f};desc="{len(trace)} queries"')
+        return response
+
+    def slowest_statements(self):
+        with self._lock:
+            return [{"seconds": round(d, 6), "sql": sql, "route": route}
+                    for d, sql, route in sorted(self.slowest, reverse=True)]
+
+    def prometheus_lines(self):
+        out = ["# HELP crm_request_duration_seconds Latência por rota.",
+               "# TYPE crm_request_duration_seconds histogram"]
+        with self._lock:
+            routes = {r: dict(st, buckets=list(st["buckets"])) for r, st in self.routes.items()}
+        for route, st in sorted(routes.items()):
+            lbl = f'route="{_escape(route)}"'
+            for le, n in zip(self.buckets, st["buckets"]):
+                out.append(f'crm_request_duration_seconds_bucket{{{lbl},le="{le}"}} {n}')
+            out.append(f'crm_request_duration_seconds_bucket{{{lbl},le="+Inf"}} {st["count"]}')
+            out.append(f"crm_request_duration_seconds_sum{{{lbl}}} {st['sum']:.6f}")
+            out.append(f"crm_request_duration_seconds_count{{{lbl}}} {st['count']}")
+        for name, key, kind, help_ in (("crm_sql_statements_total", "sql", "counter", "Statements SQL executados."),
+                                       ("crm_sql_seconds_total", "sql_seconds", "counter", "Tempo em SQL."),
+                                       ("crm_n_plus_one_total", "n_plus_one", "counter", "Padrões N+1 detectados.")):
+            out += [f"# HELP {name} {help_}", f"# TYPE {name} {kind}"]
+            out += [f'{name}{{route="{_escape(r)}"}} {st[key]}' for r, st in sorted(routes.items())]
+        return out
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def gauge_lines(name, help_, value, kind="gauge"):
+    return [f"# HELP {name} {help_}", f"# TYPE {name} {kind}", f"{name} {value}"]
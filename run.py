@@ -2,7 +2,8 @@
 """
 Robust launcher for Mini-CRM on Windows/macOS/Linux.
 - Ensures working directory is the folder of this file (SQLite path ok)
-- Initializes DB
+- Initializes DB (pending migrations only)
+- Serves with waitress (multi-threaded) when installed, Flask dev server otherwise
 - Opens browser automatically
 """
 import os, sys, threading, time, webbrowser
@@ -24,14 +25,16 @@ def open_browser():
 def main():
     set_cwd()
     try:
-        from app import app, init_db  # app.py must be in the same folder
+        import wsgi  # app.py/wsgi.py must be in the same folder; runs init_db
     except Exception as e:
         print("Erro ao importar app.py:", e)
         print("Verifique se as dependências estão instaladas e se app.py está na mesma pasta.")
         sys.exit(1)
-    init_db()
     threading.Thread(target=open_browser, daemon=True).start()
-    app.run(host="127.0.0.1", port=5000, debug=False)
+    try:
+        wsgi.serve(host="127.0.0.1", port=5000)
+    except ImportError:
+        wsgi.application.run(host="127.0.0.1", port=5000, debug=False, threaded=True)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+"""
+Gerador de base sintética para benchmarks (determinístico por --seed).
+- Nomes/cidades em português com acentos
+- Distribuições enviesadas: estágios, categorias e contatos por empresa
+- Histórico de estágios por contato (até 2 anos) para os relatórios de funil
+- Insere em lote com os triggers desligados e reconstrói status/FTS no fim
+
+Uso: python seed_data.py bench_100k.db --scale 100k [--seed 42]
+"""
+import argparse, datetime, os, random, sys, time
+
+SCALES = {"10k": 10_000, "100k": 100_000, "1m": 1_000_000}
+CHUNK = 20_000
+
+FIRST_NAMES = ["João", "José", "Antônio", "Francisco", "Luís", "Sérgio", "Márcio", "Fábio", "André", "Vinícius",
+               "Maria", "Ana", "Conceição", "Márcia", "Letícia", "Patrícia", "Luíza", "Beatriz", "Cecília", "Débora",
+               "Gonçalo", "Inês", "Tânia", "Vitória", "Lúcia", "Rafael", "Júlio", "César", "Álvaro", "Otávio"]
+SURNAMES = ["Silva", "Santos", "Oliveira", "Souza", "Araújo", "Gonçalves", "Magalhães", "Conceição", "Simões",
+            "Brandão", "Guimarães", "Assunção", "Falcão", "Estêvão", "Romão", "Gusmão", "Pereira", "Lima",
+            "Carvalho", "Ribeiro", "Almeida", "Nóbrega", "Frazão", "Leão", "Sampaio"]
+COMPANY_WORDS = ["Indústria", "Comércio", "Alimentos", "Agropecuária", "Soluções", "Distribuidora", "Logística",
+                 "Laticínios", "Construções", "Tecnologia", "Serviços", "Farmacêutica", "Açúcar", "Café", "Têxtil"]
+COMPANY_SUFFIXES = ["Ltda", "S.A.", "ME", "EIRELI", "& Filhos", "do Brasil", "Nordeste", "Paulista"]
+CITIES = [("São Paulo", "SP"), ("Ribeirão Preto", "SP"), ("Belém", "PA"), ("Goiânia", "GO"), ("Brasília", "DF"),
+          ("Florianópolis", "SC"), ("Maceió", "AL"), ("Vitória", "ES"), ("Curitiba", "PR"), ("Porto Alegre", "RS"),
+          ("São Luís", "MA"), ("Cuiabá", "MT"), ("João Pessoa", "PB"), ("Niterói", "RJ"), ("Jundiaí", "SP")]
+CATEGORIES = {"Alimentos": ["Snacks", "Laticínios", "Bebidas", "Congelados"],
+              "Agronegócio": ["Grãos", "Fertilizantes", "Máquinas"],
+              "Varejo": ["Supermercados", "Farmácias", "E-commerce"],
+              "Tecnologia": ["SaaS", "Hardware"],
+              "Saúde": ["Hospitais", "Clínicas"],
+              "Indústria": ["Química", "Têxtil", "Embalagens"]}
+ROLES = ["CEO", "CFO", "Diretor Comercial", "Gerente de Compras", "Coordenador de Marketing", "Analista", "Sócio"]
+BASE_STATUSES = [("Listado", 50), ("Mapeado", 25), ("Contatado", 15), ("Em conversa", 8), ("On Hold", 2)]
+CONTACT_STAGES = [("Contato Inicial", 40), ("Fazer FUP", 20), ("Marcar Reunião", 10), ("Reunião Marcada", 6),
+                  ("Acompanhar", 8), ("Projeto Ganho", 3), ("Projeto Perdido", 8), ("Potencial Futuro", 5)]
+OPP_STAGES = [("Qualificação", 35, 10), ("Descoberta", 25, 25), ("Proposta", 15, 50), ("Negociação", 8, 75),
+              ("Fechado - Ganho", 7, 100), ("Fechado - Perdido", 10, 0)]
+OWNERS = ["Ana Araújo", "Bruno Simões", "Cecília Falcão", "Diego Romão", "Érica Leão", ""]
+
+def _weighted(rng, pairs):
+    values, weights = zip(*[(p[0], p[1]) for p in pairs])
+    return lambda: rng.choices(values, weights)[0]
+
+def _zipf_choice(rng, items, s=1.2):
+    weights = [1 / (i + 1) ** s for i in range(len(items))]
+    return lambda: rng.choices(items, weights)[0]
+
+def generate(path, companies, contacts=None, tasks=None, opportunities=None, seed=42, log=print):
+    """Cria (ou sobrescreve) `path` com a base sintética. Devolve as contagens."""
+    contacts = companies if contacts is None else contacts
+    tasks = companies if tasks is None else tasks
+    opportunities = companies if opportunities is None else opportunities
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+    os.environ["CRM_DB"] = path
+    import app as crm
+    crm.DB_FILE = path
+    crm.init_db()
+
+    rng = random.Random(seed)
+    today = datetime.date.today()
+    t0 = time.perf_counter()
+    conn = crm._connect()
+    # bulk load sem triggers: status materializado, FTS e revisões são refeitos no fim
+    for r in conn.execute("SELECT name FROM sqlite_master WHERE type='trigger'").fetchall():
+        conn.execute(f'DROP TRIGGER "{r["name"]}"')
+    for fts in crm.SEARCH_FTS:
+        conn.execute(f"DROP TABLE IF EXISTS {fts}")
+    conn.commit()
+
+    base_status = _weighted(rng, BASE_STATUSES)
+    category = _zipf_choice(rng, list(CATEGORIES))
+    city = _zipf_choice(rng, CITIES, s=0.9)
+    used = {}  # nome base -> quantas vezes saiu (sufixo " 2", " 3"... sem busca linear)
+    def company_name():
+        name = f"{rng.choice(COMPANY_WORDS)} {rng.choice(SURNAMES)} {rng.choice(COMPANY_SUFFIXES)}"
+        n = used[name] = used.get(name, 0) + 1
+        return name if n == 1 else f"{name} {n}"
+    def company_rows(n):
+        for _ in range(n):
+            cat = category(); cty, uf = city()
+            yield (company_name(), cat, rng.choice(CATEGORIES[cat]), base_status(), cty, uf, "")
+    _insert(conn, """INSERT INTO companies (name, category, subcategory, reg_status_base, city, state, notes)
+                     VALUES (?,?,?,?,?,?,?)""", company_rows(companies))
+    log(f"companies: {companies} ({time.perf_counter() - t0:.1f}s)")
+
+    # contatos concentrados em poucas empresas (pareto), empresa i -> id i
+    stage = _weighted(rng, CONTACT_STAGES)
+    contact_stages = []
+    def company_id():
+        return min(companies, int(rng.paretovariate(1.16))) if rng.random() < 0.3 else rng.randint(1, companies)
+    def contact_rows(n):
+        for _ in range(n):
+            first, last = rng.choice(FIRST_NAMES), rng.choice(SURNAMES)
+            contact_stages.append(stage())
+            yield (company_id(), f"{first} {last}", rng.choice(ROLES),
+                   f"{crm._norm(first)}.{crm._norm(last)}{rng.randint(1, 999)}@exemplo.com.br",
+                   f"(11) 9{rng.randint(1000, 9999)}-{rng.randint(1000, 9999)}", contact_stages[-1],
+                   rng.choice((1, 2, 2, 3)))
+    _insert(conn, """INSERT INTO contacts (company_id, name, role, email, phone, contact_stage, priority)
+                     VALUES (?,?,?,?,?,?,?)""", contact_rows(contacts))
+    log(f"contacts: {contacts} ({time.perf_counter() - t0:.1f}s)")
+
+    # histórico de estágios até 2 anos atrás, terminando no estágio atual de cada contato
+    linear = [s for s, _ in CONTACT_STAGES[:5]]  # Contato Inicial .. Acompanhar
+    now = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+    def history_rows():
+        for cid, final in enumerate(contact_stages, 1):
+            path = linear[:linear.index(final) + 1] if final in linear else linear[:rng.randint(1, 5)] + [final]
+            path = [path[0]] + [p for p in path[1:-1] if rng.random() < 0.6] + path[1:][-1:]
+            ts = now - datetime.timedelta(days=rng.uniform(0, 730))
+            prev = None
+            for st in path:
+                yield (cid, prev, st, ts.strftime("%Y-%m-%d %H:%M:%S"))
+                prev = st
+                ts = min(now, ts + datetime.timedelta(days=rng.expovariate(1 / 12)))
+    _insert(conn, "INSERT INTO contact_stage_history (contact_id, from_stage, to_stage, ts) VALUES (?,?,?,?)",
+            history_rows())
+    log(f"stage history ({time.perf_counter() - t0:.1f}s)")
+
+    titles = ["Ligar para", "Enviar proposta para", "Reunião com", "Follow-up com", "Visitar"]
+    def task_rows(n):
+        for _ in range(n):
+            due = today + datetime.timedelta(days=int(rng.gauss(0, 30)))
+            ct = rng.randint(1, contacts) if contacts else None
+            yield (rng.randint(1, companies), ct, f"{rng.choice(titles)} {rng.choice(FIRST_NAMES)}",
+                   due.isoformat() if rng.random() < 0.9 else None, int(rng.random() < 0.6))
+    _insert(conn, "INSERT INTO tasks (company_id, contact_id, title, due_date, done) VALUES (?,?,?,?,?)", task_rows(tasks))
+    log(f"tasks: {tasks} ({time.perf_counter() - t0:.1f}s)")
+
+    opp_stage = _weighted(rng, OPP_STAGES)
+    probability = {s: p for s, _, p in OPP_STAGES}
+    def opp_rows(n):
+        for _ in range(n):
+            s = opp_stage()
+            close = today + datetime.timedelta(days=rng.randint(-90, 365))
+            yield (rng.randint(1, companies), f"Projeto {rng.choice(COMPANY_WORDS)}", s,
+                   round(rng.lognormvariate(10.5, 1.0), 2), probability[s], close.isoformat(), rng.choice(OWNERS))
+    _insert(conn, """INSERT INTO opportunities (company_id, title, stage, amount, probability, close_date, owner)
+                     VALUES (?,?,?,?,?,?,?)""", opp_rows(opportunities))
+    log(f"opportunities: {opportunities} ({time.perf_counter() - t0:.1f}s)")
+    conn.execute("ANALYZE")
+    conn.commit(); conn.close()
+
+    crm.init_db(force=True)  # recria triggers/FTS e recalcula company_status em lote
+    log(f"índices e triggers: {time.perf_counter() - t0:.1f}s")
+    return {"companies": companies, "contacts": contacts, "tasks": tasks, "opportunities": opportunities, "seed": seed}
+
+def _insert(conn, sql, rows):
+    batch = []
+    for r in rows:
+        batch.append(r)
+        if len(batch) >= CHUNK:
+            with conn: conn.executemany(sql, batch)
+            batch = []
+    if batch:
+        with conn: conn.executemany(sql, batch)
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("path")
+    ap.add_argument("--scale", default="10k", help="10k, 100k, 1m ou um número (empresas)")
+    ap.add_argument("--contacts", type=int); ap.add_argument("--tasks", type=int); ap.add_argument("--opportunities", type=int)
+    ap.add_argument("--seed", type=int, default=42)
+    a = ap.parse_args(argv)
+    n = SCALES.get(a.scale.lower()) or int(a.scale)
+    generate(os.path.abspath(a.path), n, a.contacts, a.tasks, a.opportunities, seed=a.seed)
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+"""
+Histórico de estágios dos contatos e relatórios de funil/velocidade.
+- contact_stage_history é gravada por trigger, na mesma transação do UPDATE
+- stage_daily / stage_transition_daily: agregados por dia, refeitos só para os
+  dias que receberam linhas novas desde a última marca (stage_rollup_state)
+- Relatórios leem só os agregados, nunca o histórico inteiro
+"""
+
+# dias com linhas novas (id > marca); o dia inteiro é reagregado
+SQL_DIRTY_DAYS = """INSERT OR IGNORE INTO temp.stage_dirty_days (day)
+                    SELECT DISTINCT date(ts) FROM contact_stage_history WHERE id > ? AND id <= ?"""
+_DIRTY_ROWS = """FROM contact_stage_history h
+                 JOIN temp.stage_dirty_days d ON h.ts >= d.day AND h.ts < date(d.day, '+1 day')"""
+# tempo no estágio = saída - entrada anterior do mesmo contato, contado no dia da saída
+SQL_STAGE_DAILY = f"""
+    INSERT INTO stage_daily (day, stage, entered, exited, dwell_seconds, dwell_n)
+    SELECT day, stage, SUM(entered), SUM(exited), IFNULL(SUM(dwell), 0), COUNT(dwell) FROM (
+      SELECT date(h.ts) AS day, h.to_stage AS stage, 1 AS entered, 0 AS exited, NULL AS dwell
+      {_DIRTY_ROWS} WHERE h.to_stage IS NOT NULL
+      UNION ALL
+      SELECT date(h.ts), h.from_stage, 0, 1,
+             (julianday(h.ts) - julianday((SELECT p.ts FROM contact_stage_history p
+                                          WHERE p.contact_id=h.contact_id AND p.id < h.id
+                                          ORDER BY p.id DESC LIMIT 1))) * 86400
+      {_DIRTY_ROWS} WHERE h.from_stage IS NOT NULL
+    ) GROUP BY day, stage"""
+# from_stage '' = contato novo
+SQL_TRANSITION_DAILY = f"""
+    INSERT INTO stage_transition_daily (day, from_stage, to_stage, n)
+    SELECT date(h.ts), IFNULL(h.from_stage, ''), h.to_stage, COUNT(*)
+    {_DIRTY_ROWS} WHERE h.to_stage IS NOT NULL
+    GROUP BY 1, 2, 3"""
+SQL_STAGE_TOTALS = """SELECT stage, SUM(entered) AS entered, SUM(exited) AS exited,
+                             SUM(dwell_seconds) AS dwell_seconds, SUM(dwell_n) AS dwell_n
+                      FROM stage_daily WHERE day BETWEEN ? AND ? GROUP BY stage"""
+SQL_TRANSITIONS = """SELECT from_stage, to_stage, SUM(n) AS n FROM stage_transition_daily
+                     WHERE day BETWEEN ? AND ? GROUP BY from_stage, to_stage"""
+
+SQL_ROLLUP_PENDING = """SELECT (SELECT last_id FROM stage_rollup_state WHERE name='stage'),
+                              (SELECT IFNULL(MAX(id), 0) FROM contact_stage_history)"""
+
+def refresh_rollups(conn):
+    """Reagrega os dias que têm histórico novo. Sem histórico novo é só uma
+    leitura; com, BEGIN IMMEDIATE para dois workers não refazerem o mesmo
+    intervalo (e não disputar a trava de escrita à toa). Devolve {"days": n, "rows": n}."""
+    last, top = conn.execute(SQL_ROLLUP_PENDING).fetchone()
+    if top <= (last or 0):
+        return {"days": 0, "rows": 0}
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        last, top = conn.execute(SQL_ROLLUP_PENDING).fetchone()  # de novo, com a trava
+        last = last or 0
+        if top <= last:
+            conn.rollback()
+            return {"days": 0, "rows": 0}
+        conn.execute("CREATE TEMP TABLE IF NOT EXISTS stage_dirty_days (day TEXT PRIMARY KEY)")
+        conn.execute("DELETE FROM temp.stage_dirty_days")
+        conn.execute(SQL_DIRTY_DAYS, (last, top))
+        days = conn.execute("SELECT COUNT(*) FROM temp.stage_dirty_days").fetchone()[0]
+        conn.execute("DELETE FROM stage_daily WHERE day IN (SELECT day FROM temp.stage_dirty_days)")
+        conn.execute("DELETE FROM stage_transition_daily WHERE day IN (SELECT day FROM temp.stage_dirty_days)")
+        conn.execute(SQL_STAGE_DAILY)
+        conn.execute(SQL_TRANSITION_DAILY)
+        conn.execute("""INSERT INTO stage_rollup_state (name, last_id) VALUES ('stage', ?)
+                        ON CONFLICT(name) DO UPDATE SET last_id=excluded.last_id""", (top,))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return {"days": days, "rows": top - last}
+
+def funnel(conn, stages, start, end, inactive=()):
+    """Entradas/saídas por estágio no período e para onde foram as saídas.
+    `advanced` = saídas para um estágio posterior na ordem de `stages` que não
+    seja inativo (perdido/futuro vêm depois na lista, mas não são conversão)."""
+    order = {s: i for i, s in enumerate(stages)}
+    inactive = set(inactive)
+    totals = {r["stage"]: r for r in conn.execute(SQL_STAGE_TOTALS, (start, end))}
+    moves = {}
+    for r in conn.execute(SQL_TRANSITIONS, (start, end)):
+        moves.setdefault(r["from_stage"], {})[r["to_stage"]] = r["n"]
+    out = []
+    for s in stages:
+        t = totals.get(s)
+        entered, exited = (t["entered"], t["exited"]) if t else (0, 0)
+        to = moves.get(s, {})
+        advanced = sum(n for dst, n in to.items() if dst not in inactive and order.get(dst, -1) > order[s])
+        out.append({"stage": s, "entered": entered, "exited": exited, "advanced": advanced,
+                    "conversion": round(advanced / exited, 4) if exited else None,
+                    "to": dict(sorted(to.items(), key=lambda kv: -kv[1]))})
+    return {"new_contacts": sum(moves.get("", {}).values()), "stages": out}
+
+def velocity(conn, stages, start, end):
+    """Tempo médio (dias) no estágio, pelas saídas do período."""
+    totals = {r["stage"]: r for r in conn.execute(SQL_STAGE_TOTALS, (start, end))}
+    out = []
+    for s in stages:
+        t = totals.get(s)
+        n = t["dwell_n"] if t else 0
+        out.append({"stage": s, "exits": n,
+                    "avg_days": round(t["dwell_seconds"] / n / 86400, 2) if n else None})
+    return out
@@ -18,7 +18,7 @@ call .venv\Scripts\activate.bat
 REM 4) Install deps
 echo [2/3] Instalando dependencias...
 python -m pip install --upgrade pip
-python -m pip install flask flask-login pandas openpyxl werkzeug
+python -m pip install flask flask-login pandas openpyxl xlsxwriter werkzeug waitress
 
 REM 5) Run
 echo [3/3] Iniciando Mini-CRM em http://127.0.0.1:5000/
@@ -1,31 +1,104 @@
 function boardDragStart(ev){
   ev.dataTransfer.setData('text/contact-id', ev.target.dataset.id);
 }
+function boardCard(c){
+  const el = document.createElement('article');
+  el.className = 'card-lead'; el.draggable = true; el.dataset.id = c.id;
+  el.addEventListener('dragstart', boardDragStart);
+  const company = document.createElement('div'); company.className = 'company'; company.textContent = c.company_name;
+  const person = document.createElement('div'); person.className = 'person'; person.textContent = c.name;
+  el.append(company, person);
+  return el;
+}
+async function boardLoadMore(btn){
+  const col = btn.closest('.board-col');
+  const body = col.querySelector('.board-col-body');
+  btn.disabled = true;
+  try{
+    const qs = new URLSearchParams({stage: col.dataset.stage, after: btn.dataset.cursor});
+    const res = await fetch(`/board/column?${qs}`);
+    const data = await res.json();
+    if(!data.ok){ alert(data.error || 'Erro ao carregar'); return; }
+    data.cards.forEach(c => body.append(boardCard(c)));
+    if(data.next){ btn.dataset.cursor = data.next; }
+    else{ btn.remove(); }
+  }catch(e){ alert('Falha ao carregar'); }
+  finally{ btn.disabled = false; }
+}
 document.addEventListener('dragover', (ev)=>{
   const col = ev.target.closest('.board-col-body');
   document.querySelectorAll('.board-col-body').forEach(n=>n.classList.remove('drag-over'));
   if(col){ col.classList.add('drag-over'); }
 });
-document.addEventListener('drop', async (ev)=>{
-  const col = ev.target.closest('.board-col');
-  if(!col) return;
-  const targetBody = col.querySelector('.board-col-body');
-  targetBody.classList.remove('drag-over');
-  const cid = ev.dataTransfer.getData('text/contact-id');
-  const newStage = col.dataset.stage;
+// Movimentos ficam pendentes por BOARD_MOVE_DEBOUNCE ms e vão num único POST
+const BOARD_MOVE_DEBOUNCE = 400;
+const boardPendingMoves = new Map();
+let boardMoveTimer = null;
+async function boardFlushMoves(){
+  boardMoveTimer = null;
+  if(!boardPendingMoves.size) return;
+  const moves = [...boardPendingMoves.entries()].map(([id, stage]) => ({id, stage}));
+  boardPendingMoves.clear();
   try{
-    const res = await fetch(`/contact/${cid}/move`,{
+    const res = await fetch('/contacts/move',{
       method:'POST',
       headers:{'Content-Type':'application/json'},
-      body: JSON.stringify({stage:newStage})
+      body: JSON.stringify({moves})
     });
     const data = await res.json();
-    if(data.ok){
-      // move card in DOM
-      const card = document.querySelector(`.card-lead[data-id='${cid}']`);
-      if(card){ targetBody.prepend(card); }
-    }else{
-      alert(data.error || 'Erro ao mover');
-    }
-  }catch(e){ alert('Falha ao mover'); }
+    if(!data.ok){ alert(data.error || 'Erro ao mover'); location.reload(); }
+  }catch(e){ alert('Falha ao mover'); location.reload(); }
+}
+document.addEventListener('drop', (ev)=>{
+  const col = ev.target.closest('.board-col');
+  if(!col) return;
+  const targetBody = col.querySelector('.board-col-body');
+  targetBody.classList.remove('drag-over');
+  const cid = ev.dataTransfer.getData('text/contact-id');
+  if(!cid) return;
+  // move o card no DOM na hora; o servidor recebe o lote em seguida
+  const card = document.querySelector(`.card-lead[data-id='${cid}']`);
+  if(card){ targetBody.prepend(card); }
+  boardPendingMoves.set(Number(cid), col.dataset.stage);
+  clearTimeout(boardMoveTimer);
+  boardMoveTimer = setTimeout(boardFlushMoves, BOARD_MOVE_DEBOUNCE);
 });
+window.addEventListener('pagehide', ()=>{
+  if(!boardPendingMoves.size) return;
+  const moves = [...boardPendingMoves.entries()].map(([id, stage]) => ({id, stage}));
+  boardPendingMoves.clear();
+  navigator.sendBeacon('/contacts/move', new Blob([JSON.stringify({moves})], {type:'application/json'}));
+});
+// Board ao vivo: /board/stream manda {id, from, to, name, company_name} por contato alterado
+function boardColumn(stage){
+  if(stage == null) return null;
+  return [...document.querySelectorAll('.board-col')].find(c => c.dataset.stage === stage) || null;
+}
+function boardBumpTotal(col, delta){
+  const el = col && col.querySelector('.board-count');
+  if(!el) return;
+  const n = Number(el.dataset.total) + delta;
+  el.dataset.total = n; el.textContent = `(${n})`;
+}
+function boardApplyEvent(ev){
+  if(ev.from !== ev.to){ boardBumpTotal(boardColumn(ev.from), -1); boardBumpTotal(boardColumn(ev.to), +1); }
+  let card = document.querySelector(`.card-lead[data-id='${ev.id}']`);
+  if(card){
+    card.querySelector('.company').textContent = ev.company_name || '';
+    card.querySelector('.person').textContent = ev.name || '';
+  }
+  if(boardPendingMoves.has(ev.id)) return;  // o movimento local ainda vai pro servidor
+  const col = boardColumn(ev.to);
+  if(!col){ if(card) card.remove(); return; }
+  const body = col.querySelector('.board-col-body');
+  if(card && card.parentElement === body) return;  // já está lá (ex.: drag feito aqui)
+  body.prepend(card || boardCard({id: ev.id, name: ev.name, company_name: ev.company_name}));
+}
+function boardStream(){
+  const grid = document.querySelector('.board-grid');
+  if(!grid || !window.EventSource) return;
+  const es = new EventSource(`/board/stream?last_id=${grid.dataset.lastEvent || ''}`);
+  es.onmessage = (m) => boardApplyEvent(JSON.parse(m.data));
+  es.addEventListener('reset', () => { es.close(); location.reload(); });
+}
+document.addEventListener('DOMContentLoaded', boardStream);
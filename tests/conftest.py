@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+import os, sys, tempfile
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+# DB_FILE é lido no import do app: base descartável antes de importar
+_TMP = tempfile.mkdtemp(prefix="crm_test_")
+os.environ["CRM_DB"] = os.path.join(_TMP, "crm_test.db")
+os.environ["CRM_DASHBOARD_TTL"] = "0"
+
+import app as crm  # noqa: E402
+
+DATA_TABLES = ("tasks", "opportunities", "contacts", "companies", "activity_log",
+               "contact_stage_history", "stage_daily", "stage_transition_daily", "stage_rollup_state")
+
+@pytest.fixture(scope="session")
+def crm_app():
+    crm.init_db()
+    return crm
+
+@pytest.fixture
+def conn(crm_app):
+    """Conexão avulsa numa base sem dados (schema e admin ficam)."""
+    c = crm._connect()
+    with c:
+        for t in DATA_TABLES:
+            c.execute(f"DELETE FROM {t}")
+    yield c
+    c.close()
+
+@pytest.fixture
+def client(crm_app, conn):
+    cl = crm.app.test_client()
+    cl.post("/login", data={"email": "admin@example.com", "password": "admin"})
+    return cl
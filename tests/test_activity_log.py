@@ -0,0 +1,12 @@
+# -*- coding: utf-8 -*-
+import app as crm
+
+def test_failed_async_flush_counts_lost_events(client, monkeypatch):
+    monkeypatch.setitem(crm.log_stats, "failed", 0)
+    w = crm.ActivityLogWriter(interval=0.05)
+    for _ in range(3):
+        w.put(("2026-01-01 00:00:00", "nota", None, None))  # 4 colunas para 5 placeholders
+    w.start(); w.stop()
+    assert w.stats["errors"] == 1 and w.stats["lost"] == 3
+    assert crm.log_stats["failed"] == 3 and crm.log_stats["last_error"]
+    assert "crm_activity_log_failed_total 3" in client.get("/metrics").get_data(as_text=True)
@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+import pytest
+from werkzeug.security import generate_password_hash
+
+import app as crm
+
+@pytest.fixture
+def token(conn):
+    uid = conn.execute("SELECT id FROM users WHERE email='admin@example.com'").fetchone()[0]
+    return crm.issue_api_token(conn, uid)
+
+@pytest.mark.parametrize("path", ["/dashboard", "/admin/db/pool"])
+def test_bad_token_is_401_json(crm_app, token, path):
+    r = crm.app.test_client().get(path, headers={"Authorization": "Bearer nao-existe"})
+    assert r.status_code == 401 and r.get_json()["ok"] is False
+
+def test_valid_token(crm_app, token):
+    r = crm.app.test_client().get("/admin/db/pool", headers={"Authorization": f"Bearer {token}"})
+    assert r.status_code == 200
+
+def test_wrong_role_token_is_403(conn):
+    with conn:
+        uid = conn.execute("INSERT OR REPLACE INTO users (name,email,pwd_hash,role) VALUES (?,?,?,?)",
+                           ("Vend", "vend@example.com", generate_password_hash("x"), "sales")).lastrowid
+    token = crm.issue_api_token(conn, uid)
+    r = crm.app.test_client().get("/admin/db/pool", headers={"Authorization": f"Bearer {token}"})
+    assert r.status_code == 403
+
+def test_browser_still_redirects(crm_app):
+    r = crm.app.test_client().get("/dashboard")
+    assert r.status_code == 302 and "/login" in r.headers["Location"]
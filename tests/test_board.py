@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+import app as crm
+
+@pytest.fixture
+def contacts(conn):
+    with conn:
+        cid = conn.execute("INSERT INTO companies (name) VALUES ('Board Lote SA')").lastrowid
+        return [conn.execute("INSERT INTO contacts (company_id, name, contact_stage) VALUES (?,?,'Contato Inicial')",
+                             (cid, f"B{i}")).lastrowid for i in range(3)]
+
+def test_batch_move_last_destination_wins(client, conn, contacts):
+    a, b, c = contacts
+    r = client.post("/contacts/move", json={"moves": [{"id": a, "stage": "Fazer FUP"}, {"id": b, "stage": "Acompanhar"},
+                                                      {"id": a, "stage": "Marcar Reunião"}, {"id": c, "stage": "Contato Inicial"}]})
+    assert r.get_json() == {"ok": True, "received": 4, "applied": 2}
+    stages = dict(conn.execute("SELECT id, contact_stage FROM contacts").fetchall())
+    assert (stages[a], stages[b], stages[c]) == ("Marcar Reunião", "Acompanhar", "Contato Inicial")
+
+@pytest.mark.parametrize("body", [[1, 2], "x", {"moves": []}, {"moves": [1]}, {"moves": [["id", "stage"]]},
+                                  {"moves": [{"id": 1, "stage": []}]}, {"moves": [{"id": "a", "stage": "Fazer FUP"}]},
+                                  {"moves": [{"id": 1}]}, {"moves": [{"id": 1, "stage": "Nao existe"}]},
+                                  {"moves": [{"id": 1, "stage": "Fazer FUP"}] * (crm.MOVE_MAX_BATCH + 1)}])
+def test_batch_move_rejects_bad_body(client, contacts, body):
+    assert client.post("/contacts/move", json=body).status_code == 400
+
+@pytest.mark.parametrize("body", [[1, 2], {"stage": []}, {"stage": "Nao existe"}])
+def test_single_move_rejects_bad_body(client, contacts, body):
+    assert client.post(f"/contact/{contacts[0]}/move", json=body).status_code == 400
+
+@pytest.fixture
+def column(conn):
+    """Uma coluna maior que BOARD_PAGE, com prioridades e empresas misturadas."""
+    with conn:
+        cos = [conn.execute("INSERT INTO companies (name) VALUES (?)", (n,)).lastrowid for n in ("Zeta", "Alfa", "Meio")]
+        conn.executemany("INSERT INTO contacts (company_id, name, contact_stage, priority) VALUES (?,?,'Acompanhar',?)",
+                         [(cos[i % 3], f"K{i % 17:02d}", (None, 1, 2)[i % 4 % 3]) for i in range(crm.BOARD_PAGE * 2 + 7)])
+    return conn.execute(f"""SELECT ct.id FROM contacts ct JOIN companies co ON co.id=ct.company_id
+                            WHERE ct.contact_stage='Acompanhar' ORDER BY {crm.BOARD_ORDER}""").fetchall()
+
+def test_board_pages_follow_order(client, column):
+    html = client.get("/board").get_data(as_text=True)
+    assert "Acompanhar" in html
+    seen, after = [], None
+    while True:
+        qs = {"stage": "Acompanhar", "limit": 30}
+        if after: qs["after"] = after
+        body = client.get("/board/column", query_string=qs).get_json()
+        seen += [c["id"] for c in body["cards"]]
+        after = body["next"]
+        if not after: break
+    assert seen == [r[0] for r in column]
+
+@pytest.mark.parametrize("after", ['[[1],"a","b",1]', '[1,"a","b","x"]', '[1,2,"b",1]', '[1,"a",null,1]',
+                                   '[1,"a","b"]', '{"a":1,"b":2,"c":3,"d":4}', "5", "nao-json"])
+def test_board_column_bad_cursor_is_400(client, after):
+    r = client.get("/board/column", query_string={"stage": "Acompanhar", "after": after})
+    assert r.status_code == 400
@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+import app as crm
+
+def _add_events(conn, n):
+    with conn:
+        conn.executemany("INSERT INTO board_events (contact_id, to_stage) VALUES (?, 'Lead')",
+                         [(i,) for i in range(n)])
+
+def test_trigger_prunes_without_relay(conn):
+    with conn:
+        conn.execute("DELETE FROM board_events")
+    _add_events(conn, crm.BOARD_EVENTS_KEEP + 3 * crm.BOARD_EVENTS_PRUNE_EVERY)
+    lo, hi, n = conn.execute("SELECT MIN(id), MAX(id), COUNT(*) FROM board_events").fetchone()
+    assert n <= crm.BOARD_EVENTS_KEEP + crm.BOARD_EVENTS_PRUNE_EVERY
+    assert hi - lo + 1 == n
+
+def test_wipe_clears_board_events(client, conn):
+    with conn:
+        cid = conn.execute("INSERT INTO companies (name) VALUES ('Board SA')").lastrowid
+        conn.execute("INSERT INTO contacts (company_id, name, contact_stage) VALUES (?, 'Ana', 'Lead')", (cid,))
+    assert client.post("/settings/wipe").status_code == 302
+    assert conn.execute("SELECT COUNT(*) FROM board_events").fetchone()[0] == 0
+
+def test_relay_resets_after_wipe(conn):
+    bus = crm.BoardEventBus(max_streams=0)
+    bus._conn = conn
+    _add_events(conn, 3)
+    bus._read()
+    seen = bus.last_id
+    assert bus.wait(seen - 1, 0)
+    _add_events(conn, 2)
+    with conn:
+        conn.execute("DELETE FROM board_events")
+    bus._read()
+    assert bus.last_id == seen + 2 and bus.stats["resets"] == 1
+    assert bus.wait(seen, 0) is None       # cliente recarrega
+    bus._read()
+    assert bus.stats["resets"] == 1        # sem eventos novos, sem novo reset
@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+import threading, time
+
+import pytest
+
+import app as crm
+
+def _events(body):
+    out = []
+    for block in body.split("\n\n"):
+        fields = dict(line.split(": ", 1) for line in block.splitlines() if ": " in line and not line.startswith(":"))
+        if "data" in fields or "event" in fields:
+            out.append(fields)
+    return out
+
+def _relay_reaches(event_id, timeout=5):
+    bus = crm.board_bus
+    deadline = time.monotonic() + timeout
+    while bus.last_id < event_id and time.monotonic() < deadline:
+        bus.poke(); time.sleep(0.05)
+    assert bus.last_id >= event_id
+
+@pytest.fixture
+def contact(conn):
+    with conn:
+        cid = conn.execute("INSERT INTO companies (name) VALUES ('Stream SA')").lastrowid
+        return conn.execute("INSERT INTO contacts (company_id, name, contact_stage) VALUES (?, 'Eva', 'Contato Inicial')",
+                            (cid,)).lastrowid
+
+def test_default_is_polling(client, conn, contact):
+    """Workers de thread: sem vaga de stream, manda os deltas e fecha com retry longo."""
+    assert crm.board_bus.max_streams == 0
+    client.get("/board/stream")  # liga o relay
+    before = conn.execute("SELECT MAX(id) FROM board_events").fetchone()[0]
+    crm.apply_moves(conn, [(contact, "Fazer FUP")])
+    top = conn.execute("SELECT MAX(id) FROM board_events").fetchone()[0]
+    _relay_reaches(top)
+    r = client.get("/board/stream", headers={"Last-Event-ID": str(before)})
+    assert r.mimetype == "text/event-stream"
+    body = r.get_data(as_text=True)
+    assert body.startswith(f"retry: {crm.BOARD_POLL_RETRY_MS}\n")
+    ev = _events(body)
+    assert [e["id"] for e in ev] == [str(top)]
+    assert '"to": "Fazer FUP"' in ev[0]["data"] and '"name": "Eva"' in ev[0]["data"]
+    # já em dia: nada a mandar
+    assert _events(client.get("/board/stream", headers={"Last-Event-ID": str(top)}).get_data(as_text=True)) == []
+
+@pytest.fixture
+def bus(monkeypatch):
+    """Relay próprio do teste (buffer pequeno, vagas configuráveis)."""
+    def make(**kw):
+        b = crm.BoardEventBus(poll=0.05, **kw)
+        monkeypatch.setattr(crm, "board_bus", b)
+        return b
+    return make
+
+def test_stale_client_gets_reset(client, conn, contact, bus):
+    b = bus(buffer=2, max_streams=0)
+    client.get("/board/stream")
+    for stage in ("Fazer FUP", "Acompanhar", "Marcar Reunião"):
+        crm.apply_moves(conn, [(contact, stage)])
+    top = conn.execute("SELECT MAX(id) FROM board_events").fetchone()[0]
+    _relay_reaches(top)
+    assert b.floor > 0
+    ev = _events(client.get("/board/stream", headers={"Last-Event-ID": str(b.floor - 1)}).get_data(as_text=True))
+    assert ev == [{"event": "reset", "id": str(top), "data": "{}"}]
+
+def test_held_stream_pushes(client, conn, contact, bus, monkeypatch):
+    """Com vaga (gevent), o stream fica aberto e recebe o movimento feito depois."""
+    b = bus(max_streams=1)
+    monkeypatch.setattr(crm, "BOARD_STREAM_SECONDS", 1.0)
+    client.get("/board/stream").close()  # liga o relay e devolve a vaga
+    top = conn.execute("SELECT MAX(id) FROM board_events").fetchone()[0]
+    _relay_reaches(top)
+    mover = threading.Timer(0.2, lambda: crm.apply_moves(crm._connect(), [(contact, "Projeto Ganho")]))
+    mover.start()
+    t0 = time.monotonic()
+    r = client.get("/board/stream", headers={"Last-Event-ID": str(top)})
+    body = r.get_data(as_text=True); r.close()
+    mover.join()
+    assert body.startswith("retry: 1000\n")
+    assert ['"to": "Projeto Ganho"' in e["data"] for e in _events(body)] == [True]
+    assert time.monotonic() - t0 >= 0.9  # ficou aberto até BOARD_STREAM_SECONDS
+    assert b.stats["streams_open"] == 0 and b.stats["streams_total"] == 2
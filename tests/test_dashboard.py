@@ -0,0 +1,21 @@
+# -*- coding: utf-8 -*-
+import datetime
+
+import dashboard_stats
+
+def test_task_windows_use_given_day(conn):
+    today = datetime.date(2026, 3, 10)
+    with conn:
+        cid = conn.execute("INSERT INTO companies (name) VALUES ('Prazo SA')").lastrowid
+        conn.executemany("INSERT INTO tasks (company_id, title, due_date, done) VALUES (?,?,?,0)",
+                         [(cid, d, d) for d in ("2026-03-09", "2026-03-10", "2026-03-17", "2026-03-18")])
+    st = dashboard_stats.general_stats(conn, today)
+    assert [t["due_date"] for t in st["overdue"]] == ["2026-03-09"]
+    assert [t["due_date"] for t in st["next7"]] == ["2026-03-10", "2026-03-17"]
+    # um dia depois (ex.: virou a meia-noite local antes da UTC)
+    st = dashboard_stats.general_stats(conn, today + datetime.timedelta(days=1))
+    assert [t["due_date"] for t in st["overdue"]] == ["2026-03-09", "2026-03-10"]
+
+def test_dashboard_renders(client):
+    r = client.get("/dashboard")
+    assert r.status_code == 200
@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+import json
+
+import pytest
+
+import app as crm
+
+@pytest.fixture
+def seeded(conn):
+    with conn:
+        conn.executemany("INSERT INTO companies (name) VALUES (?)", [(f"Exporta {i:03d}",) for i in range(25)])
+    crm.rebuild_company_status(conn, crm.load_settings(conn))
+
+@pytest.fixture
+def pool_peak(monkeypatch):
+    """Máximo de conexões do pool presas ao mesmo tempo durante o teste."""
+    pool = crm.get_pool()
+    held, peak = [0], [0]
+    acquire, release = pool.acquire, pool.release
+    def tracked_acquire():
+        c = acquire(); held[0] += 1; peak[0] = max(peak[0], held[0])
+        return c
+    def tracked_release(c):
+        held[0] -= 1; release(c)
+    monkeypatch.setattr(pool, "acquire", tracked_acquire)
+    monkeypatch.setattr(pool, "release", tracked_release)
+    crm.user_cache.invalidate()  # user_loader vai ao banco: o request segura g.db
+    return peak
+
+def test_xlsx_uses_request_connection(client, seeded, pool_peak):
+    r = client.get("/export/companies.xlsx")
+    assert r.status_code == 200 and r.data[:2] == b"PK"
+    assert pool_peak[0] == 1
+
+@pytest.mark.parametrize("fmt, lines", [("csv", 26), ("ndjson", 25)])
+def test_stream_holds_one_connection(client, seeded, pool_peak, fmt, lines):
+    body = client.get(f"/export/companies.{fmt}").get_data(as_text=True)
+    assert body.count("\n") == lines and pool_peak[0] == 1
+    if fmt == "ndjson":
+        assert json.loads(body.splitlines()[0])["name"] == "Exporta 000"
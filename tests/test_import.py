@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+import io
+
+import openpyxl
+
+import app as crm
+
+def _post(client, data, name):
+    return client.post("/import", data={"file": (io.BytesIO(data), name)}, content_type="multipart/form-data")
+
+def test_cp1252_csv(client, conn):
+    data = "empresa;cidade;contato\nAção Ltda;São Paulo;João\nPadaria Reunião;Belém;\n".encode("cp1252")
+    r = _post(client, data, "excel.csv")
+    assert r.status_code == 200 and r.get_json()["companies_new"] == 2
+    assert conn.execute("SELECT city FROM companies WHERE name='Ação Ltda'").fetchone()[0] == "São Paulo"
+
+def test_bad_bytes_after_first_batch(client, conn):
+    """utf-8 no começo, byte inválido depois do primeiro lote: o que entrou fica no relatório."""
+    good = "".join(f"Empresa {i:05d},Campinas\n" for i in range(4000))
+    data = ("empresa,cidade\n" + good).encode("utf-8") + b"Caf\xe9 Central,Santos\n" + b"Depois,Santos\n"
+    report = crm.import_companies(conn, crm.read_import_file(io.BytesIO(data), "x.csv"), batch_size=1000)
+    assert report["aborted"].startswith("linha ")
+    assert report["rows"] == 4000 and report["companies_new"] == 4000
+    assert conn.execute("SELECT COUNT(*) FROM companies").fetchone()[0] == 4000
+
+def test_corrupt_xlsx_is_400(client, conn):
+    r = _post(client, b"PK\x03\x04 isto nao e um zip", "planilha.xlsx")
+    body = r.get_json()
+    assert r.status_code == 400 and body["ok"] is False and body["rows"] == 0
+
+def test_xlsx(client, conn):
+    wb = openpyxl.Workbook(); ws = wb.active
+    ws.append(["Nome da empresa", "UF", "Contato", "Estágio"])
+    ws.append(["Planilha SA", "SP", "Ana", "Contato Inicial"])
+    ws.append(["Planilha SA", "SP", "Bia", "nao existe"])
+    buf = io.BytesIO(); wb.save(buf)
+    body = _post(client, buf.getvalue(), "p.xlsx").get_json()
+    assert body["ok"] and body["companies_new"] == 1 and body["contacts_new"] == 1
+    assert body["errors"] == [{"line": 3, "error": "estágio inválido: nao existe"}]
@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+import dashboard_stats
+
+def _plan(conn, name):
+    sql, params = dashboard_stats.DASHBOARD_QUERIES[name]
+    return [r[3] for r in conn.execute("EXPLAIN QUERY PLAN " + sql, params)]
+
+def test_overdue_is_range_search_on_partial_index(conn):
+    assert any(st.startswith("SEARCH t USING INDEX idx_tasks_open_due") for st in _plan(conn, "tasks_overdue"))
+
+def test_next7_is_range_search_on_partial_index(conn):
+    assert any(st.startswith("SEARCH t USING INDEX idx_tasks_open_due") for st in _plan(conn, "tasks_next7"))
+
+def test_no_scan_outside_allowlist(conn):
+    assert dashboard_stats.full_scans(conn) == {}
+
+def test_allowlist_catches_index_scan(conn):
+    # SCAN ... USING INDEX (sem COVERING) também é regressão
+    q = {"funnel": ("SELECT name FROM contacts INDEXED BY idx_contacts_stage ORDER BY contact_stage", ())}
+    assert "funnel" in dashboard_stats.full_scans(conn, q)
@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+import random
+
+import pytest
+
+import app as crm
+import seed_data
+
+QUERIES = ["reuniao", "Reunião", "sao paulo", "São Paulo", "ribeirao", "Ribeirão Preto",
+           "conceicao", "gonç", "araujo silva", "joão", "JOAO", "lat", "cafe acucar"]
+
+@pytest.fixture
+def seeded(conn):
+    rng = random.Random(7)
+    with conn:
+        for i in range(120):
+            city, uf = rng.choice(seed_data.CITIES)
+            cat = rng.choice(list(seed_data.CATEGORIES))
+            name = f"{rng.choice(seed_data.COMPANY_WORDS)} {rng.choice(seed_data.SURNAMES)} {i}"
+            notes = rng.choice(["Reunião marcada", "reuniao remarcada", "", "Sem retorno"])
+            cid = conn.execute("""INSERT INTO companies (name, category, subcategory, city, state, notes)
+                                  VALUES (?,?,?,?,?,?)""",
+                               (name, cat, rng.choice(seed_data.CATEGORIES[cat]), city, uf, notes)).lastrowid
+            for _ in range(rng.randint(0, 2)):
+                conn.execute("INSERT INTO contacts (company_id, name, role, email, notes) VALUES (?,?,?,?,?)",
+                             (cid, f"{rng.choice(seed_data.FIRST_NAMES)} {rng.choice(seed_data.SURNAMES)}",
+                              rng.choice(seed_data.ROLES), "", rng.choice(["", "Reunião em São Paulo"])))
+    return conn
+
+def _tokens(*values):
+    return set("".join(ch if ch.isalnum() else " " for ch in crm._norm(" ".join(v or "" for v in values))).split())
+
+def _reference(conn, q):
+    """Casamento esperado só com _norm(): todo termo é prefixo de algum token da linha."""
+    terms = _tokens(q)
+    out = set()
+    for kind, (table, cols) in (("company", crm.SEARCH_FTS["companies_fts"]), ("contact", crm.SEARCH_FTS["contacts_fts"])):
+        for r in conn.execute(f"SELECT id, {', '.join(cols)} FROM {table}"):
+            toks = _tokens(*[r[c] for c in cols])
+            if all(any(t.startswith(term) for t in toks) for term in terms):
+                out.add((kind, r["id"]))
+    return out
+
+def _search(client, q, **args):
+    return client.get("/search", query_string={"q": q, **args}).get_json()
+
+def _all_pages(client, q, limit):
+    seen, after = [], None
+    while True:
+        page = _search(client, q, limit=limit, **({"after": after} if after else {}))
+        seen += [(r["kind"], r["id"]) for r in page["results"]]
+        after = page["next"]
+        if not after:
+            return seen
+
+@pytest.mark.parametrize("plain, accented", [("reuniao", "Reunião"), ("sao paulo", "São Paulo"),
+                                             ("joao", "JOÃO"), ("ribeirao preto", "Ribeirão Preto")])
+def test_accents_and_case_do_not_matter(client, seeded, plain, accented):
+    a = _all_pages(client, plain, 100)
+    assert a and a == _all_pages(client, accented, 100)
+
+@pytest.mark.parametrize("q", QUERIES)
+def test_fts_agrees_with_norm(client, seeded, q):
+    assert set(_all_pages(client, q, 100)) == _reference(seeded, q)
+
+def test_keyset_pagination_covers_every_row_once(client, seeded):
+    big = _all_pages(client, "reuniao", 100)
+    small = _all_pages(client, "reuniao", 7)
+    assert len(big) > 100  # mais de uma página nos dois casos
+    assert small == big
+    assert len(small) == len(set(small)) and set(small) == _reference(seeded, "reuniao")
+
+def test_bad_cursor_is_400(client, seeded):
+    assert client.get("/search", query_string={"q": "reuniao", "after": "[1]"}).status_code == 400
@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+import app as crm
+import stage_history
+
+STAGES = ("Lead", "Qualificado", "Proposta", "Fechado")
+
+def _rollups(conn):
+    daily = conn.execute("""SELECT day, stage, entered, exited, round(dwell_seconds, 3), dwell_n
+                            FROM stage_daily ORDER BY day, stage""").fetchall()
+    trans = conn.execute("SELECT day, from_stage, to_stage, n FROM stage_transition_daily ORDER BY 1, 2, 3").fetchall()
+    return [tuple(r) for r in daily], [tuple(r) for r in trans]
+
+def _history(conn, rows):
+    """Movimentos com data explícita (o trigger grava CURRENT_TIMESTAMP)."""
+    with conn:
+        conn.executemany("INSERT INTO contact_stage_history (contact_id, from_stage, to_stage, ts) VALUES (?,?,?,?)", rows)
+
+def test_incremental_refresh_matches_full_rebuild(conn):
+    with conn:
+        cid = conn.execute("INSERT INTO companies (name) VALUES ('Funil SA')").lastrowid
+        ids = [conn.execute("INSERT INTO contacts (company_id, name, contact_stage) VALUES (?,?,?)",
+                            (cid, f"C{i}", "Lead")).lastrowid for i in range(6)]
+        conn.execute("UPDATE contact_stage_history SET ts='2026-01-01 09:00:00'")
+    assert stage_history.refresh_rollups(conn)["rows"] == 6
+
+    _history(conn, [(ids[0], "Lead", "Qualificado", "2026-01-02 10:00:00"),
+                    (ids[1], "Lead", "Qualificado", "2026-01-02 11:00:00"),
+                    (ids[2], "Lead", "Proposta", "2026-01-03 08:00:00")])
+    assert stage_history.refresh_rollups(conn)["days"] == 2
+    # dia já agregado recebe mais linhas: tem que ser refeito inteiro
+    _history(conn, [(ids[0], "Qualificado", "Proposta", "2026-01-03 15:00:00"),
+                    (ids[3], "Lead", "Qualificado", "2026-01-03 16:30:00"),
+                    (ids[1], "Qualificado", "Lead", "2026-01-04 12:00:00")])
+    stage_history.refresh_rollups(conn)
+    # e movimentos de verdade (trigger, hoje)
+    assert crm.apply_moves(conn, [(ids[0], "Fechado"), (ids[4], "Proposta"), (ids[5], "Lead")]) == 2
+    assert stage_history.refresh_rollups(conn)["rows"] == 2
+    assert stage_history.refresh_rollups(conn) == {"days": 0, "rows": 0}
+    incremental = _rollups(conn)
+
+    with conn:
+        for t in ("stage_daily", "stage_transition_daily", "stage_rollup_state"):
+            conn.execute(f"DELETE FROM {t}")
+    stage_history.refresh_rollups(conn)
+    assert _rollups(conn) == incremental
+
+    # totais batem com o histórico bruto
+    for stage in STAGES:
+        entered, exited = conn.execute("""SELECT IFNULL(SUM(entered), 0), IFNULL(SUM(exited), 0)
+                                          FROM stage_daily WHERE stage=?""", (stage,)).fetchone()
+        assert entered == conn.execute("SELECT COUNT(*) FROM contact_stage_history WHERE to_stage=?", (stage,)).fetchone()[0]
+        assert exited == conn.execute("SELECT COUNT(*) FROM contact_stage_history WHERE from_stage=?", (stage,)).fetchone()[0]
+    n = conn.execute("SELECT SUM(n) FROM stage_transition_daily").fetchone()[0]
+    assert n == conn.execute("SELECT COUNT(*) FROM contact_stage_history WHERE to_stage IS NOT NULL").fetchone()[0]
+
+def test_report_reads_rollups(client, conn):
+    with conn:
+        cid = conn.execute("INSERT INTO companies (name) VALUES ('Relatorio SA')").lastrowid
+        ct = conn.execute("INSERT INTO contacts (company_id, name, contact_stage) VALUES (?,?,?)",
+                          (cid, "R", crm.load_settings(conn)["contact_stages"][0])).lastrowid
+    stage = crm.load_settings(conn)["contact_stages"][1]
+    crm.apply_moves(conn, [(ct, stage)])
+    body = client.get("/api/stages/report").get_json()
+    moved = {s["stage"]: s for s in body["funnel"]["stages"]}
+    assert moved[stage]["entered"] == 1
+    assert body["funnel"]["new_contacts"] == 1
+
+def test_lost_exits_are_not_conversions(client, conn):
+    cfg = crm.load_settings(conn)
+    first, lost = cfg["contact_stages"][0], cfg["inactive_stages"][0]
+    nxt = cfg["contact_stages"][1]
+    with conn:
+        cid = conn.execute("INSERT INTO companies (name) VALUES ('Perdido SA')").lastrowid
+        ids = [conn.execute("INSERT INTO contacts (company_id, name, contact_stage) VALUES (?,?,?)",
+                            (cid, f"P{i}", first)).lastrowid for i in range(4)]
+    crm.apply_moves(conn, [(ids[0], lost), (ids[1], lost), (ids[2], lost), (ids[3], nxt)])
+    body = client.get("/api/stages/report").get_json()
+    row = {s["stage"]: s for s in body["funnel"]["stages"]}[first]
+    assert row["exited"] == 4 and row["to"][lost] == 3
+    assert row["advanced"] == 1 and row["conversion"] == 0.25
+
+def test_refresh_without_new_history_does_not_take_write_lock(conn):
+    stage_history.refresh_rollups(conn)
+    other = crm._connect()
+    other.execute("BEGIN IMMEDIATE")  # outro worker escrevendo
+    try:
+        conn.execute("PRAGMA busy_timeout=50")
+        assert stage_history.refresh_rollups(conn) == {"days": 0, "rows": 0}
+    finally:
+        other.rollback(); other.close()
+        conn.execute(f"PRAGMA busy_timeout={dict(crm.DB_PRAGMAS)['busy_timeout']}")
+
+def test_backfill_gives_dragged_contacts_an_entry(conn):
+    with conn:
+        cid = conn.execute("INSERT INTO companies (name) VALUES ('Legado SA')").lastrowid
+        moved = conn.execute("""INSERT INTO contacts (company_id, name, contact_stage, created_at)
+                                VALUES (?, 'Antigo', 'Acompanhar', '2025-01-01 08:00:00')""", (cid,)).lastrowid
+        still = conn.execute("""INSERT INTO contacts (company_id, name, contact_stage, created_at)
+                                VALUES (?, 'Parado', 'Fazer FUP', '2025-01-02 08:00:00')""", (cid,)).lastrowid
+        conn.executemany("INSERT INTO activity_log (ts, type, company_id, contact_id, details) VALUES (?,?,?,?,?)",
+                         [(ts, "contact_stage_drag", cid, moved, f"Estágio → <b>{st}</b>")
+                          for ts, st in (("2025-01-05 10:00:00", "Fazer FUP"), ("2025-01-09 10:00:00", "Acompanhar"))])
+        for t in ("contact_stage_history", "stage_daily", "stage_transition_daily", "stage_rollup_state"):
+            conn.execute(f"DELETE FROM {t}")
+    crm.ensure_stage_history(conn)
+    hist = conn.execute("SELECT contact_id, from_stage, to_stage, ts FROM contact_stage_history ORDER BY id").fetchall()
+    assert [tuple(r) for r in hist] == [
+        (moved, None, "Contato Inicial", "2025-01-01 08:00:00"),
+        (still, None, "Fazer FUP", "2025-01-02 08:00:00"),
+        (moved, "Contato Inicial", "Fazer FUP", "2025-01-05 10:00:00"),
+        (moved, "Fazer FUP", "Acompanhar", "2025-01-09 10:00:00")]
+    f = stage_history.funnel(conn, crm.DEFAULT_SETTINGS["contact_stages"], "2025-01-01", "2025-01-31")
+    assert f["new_contacts"] == 2
+    assert f["stages"][0]["exited"] == 1 and f["stages"][0]["advanced"] == 1
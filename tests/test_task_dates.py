@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+@pytest.fixture
+def company(conn):
+    with conn:
+        return conn.execute("INSERT INTO companies (name) VALUES ('Tarefas Ltda')").lastrowid
+
+def _task(conn, company, due):
+    with conn:
+        tid = conn.execute("INSERT INTO tasks (company_id, title, due_date) VALUES (?,?,?)",
+                           (company, "t", due)).lastrowid
+    return conn.execute("SELECT due_date, due_date_raw FROM tasks WHERE id=?", (tid,)).fetchone()
+
+@pytest.mark.parametrize("due, iso", [("2026-03-05", "2026-03-05"), ("05/03/2026", "2026-03-05"),
+                                      (" 2026-03-05 ", "2026-03-05"), ("", None), (None, None)])
+def test_dates_normalized(conn, company, due, iso):
+    assert tuple(_task(conn, company, due)) == (iso, None)
+
+def test_unparseable_date_is_kept(conn, company):
+    assert tuple(_task(conn, company, "amanhã")) == (None, "amanhã")
+
+def test_update_keeps_raw_until_valid_date(conn, company):
+    _task(conn, company, "semana que vem")
+    with conn:
+        conn.execute("UPDATE tasks SET done=5")
+    assert tuple(conn.execute("SELECT due_date, due_date_raw, done FROM tasks").fetchone()) == (None, "semana que vem", 1)
+    with conn:
+        conn.execute("UPDATE tasks SET due_date='10/04/2026'")
+    assert tuple(conn.execute("SELECT due_date, due_date_raw FROM tasks").fetchone()) == ("2026-04-10", None)
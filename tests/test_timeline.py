@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+import os
+
+import pytest
+
+import app as crm
+
+@pytest.fixture
+def company(conn):
+    with conn:
+        cid = conn.execute("INSERT INTO companies (name) VALUES ('Linha do Tempo SA')").lastrowid
+        conn.executemany("INSERT INTO activity_log (ts, type, company_id, details) VALUES (?,?,?,?)",
+                         [(f"2026-01-{d:02d} 10:00:00", "nota", cid, str(d)) for d in range(1, 8)])
+    return cid
+
+def test_pages_follow_cursor(client, company):
+    first = client.get(f"/company/{company}/timeline?limit=4").get_json()
+    rest = client.get(f"/company/{company}/timeline", query_string={"limit": 4, "after": first["next"]}).get_json()
+    assert [e["details"] for e in first["events"] + rest["events"]] == [str(d) for d in range(7, 0, -1)]
+    assert rest["next"] is None
+
+@pytest.mark.parametrize("after", ["5", "[1,2,3]", "[1]", '"x"', "{}", '["2026-01-01", "abc"]', "nao-json"])
+def test_bad_cursor_is_400(client, company, after):
+    assert client.get(f"/company/{company}/timeline", query_string={"after": after}).status_code == 400
+
+def test_archive_file_follows_db_file(conn, tmp_path, monkeypatch):
+    monkeypatch.setattr(crm, "DB_FILE", str(tmp_path / "bench_10k.db"))
+    out = crm.compact_activity_log(conn, 10000)
+    assert out["archive_file"] == str(tmp_path / "bench_10k_archive.db")
+    assert os.path.exists(out["archive_file"])
@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+"""
+Entrada WSGI de produção.
+- gunicorn:  gunicorn --workers 4 --threads 4 --bind 0.0.0.0:8000 wsgi:application
+- waitress (Windows também):  python wsgi.py  [CRM_HOST, CRM_PORT, CRM_THREADS]
+- board ao vivo: com workers de thread (Procfile, waitress) é polling: o
+  /board/stream manda os deltas e fecha, e o navegador volta a cada ~3 s.
+  Push com stream aberto exige instalar gevent e rodar gunicorn -k gevent
+  --worker-connections 1000 (não é o padrão; ver app.board_stream_cap)
+Cada processo chama init_db no import. As migrações pendentes rodam sob uma
+trava entre processos (ver app.migrate): o primeiro worker aplica, os outros
+esperam a trava e encontram schema_migrations em dia.
+"""
+import os
+from app import app, init_db, SERVER_THREADS
+
+def create_app():
+    init_db()
+    return app
+
+application = create_app()
+
+def serve(host=None, port=None, threads=None):
+    from waitress import serve as waitress_serve
+    waitress_serve(application,
+                   host=host or os.environ.get("CRM_HOST", "127.0.0.1"),
+                   port=int(port or os.environ.get("CRM_PORT", "5000")),
+                   threads=int(threads or SERVER_THREADS))
+
+if __name__ == "__main__":
+    serve()